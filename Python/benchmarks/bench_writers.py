@@ -0,0 +1,81 @@
+"""
+Compare the write paths of pullers on many concurrent files.
+
+Usage: python benchmarks/bench_writers.py [files] [MiB per file] [dir]
+"""
+import os
+import sys
+import time
+import asyncio
+import threading
+from tempfile import TemporaryDirectory
+from vermils.io import aio
+from vermils.io.puller import WriterPool
+
+CHUNK = 2**18  # Chunk size of `AsyncWorker`
+
+
+async def aio_open(paths, size, _):
+    async def one(path):
+        async with aio.open(path, "wb") as f:
+            for _ in range(size // CHUNK):
+                await f.write(DATA)
+    await asyncio.gather(*map(one, paths))
+
+
+async def pooled(paths, size, pool):
+    async def one(path):
+        async with pool.open(path, "wb") as f:
+            for _ in range(size // CHUNK):
+                await f.write(DATA)
+    await asyncio.gather(*map(one, paths))
+
+
+async def positional(paths, size, pool):
+    async def one(path):
+        async with pool.open_positional(path) as f:
+            await f.allocate(size)
+            cursor = f.cursor(0)
+            for _ in range(size // CHUNK):
+                await cursor.write(DATA)
+    await asyncio.gather(*map(one, paths))
+
+
+async def bench(name, func, files, size, root):
+    pool = WriterPool()
+    paths = [os.path.join(root, f"{name}{i}") for i in range(files)]
+    baseline = peak = threading.active_count()
+
+    async def sample():
+        nonlocal peak
+        while True:
+            peak = max(peak, threading.active_count())
+            await asyncio.sleep(0.01)
+
+    sampler = asyncio.create_task(sample())
+    start = time.perf_counter()
+    await func(paths, size, pool)
+    elapsed = time.perf_counter() - start
+    sampler.cancel()
+    await pool.aclose()
+    for path in paths:
+        os.remove(path)
+    mib = files * size / 2**20
+    print(f"{name:<12}{elapsed:>8.2f}s{mib / elapsed:>10.1f} MiB/s"
+          f"{peak - baseline:>8} threads")
+
+
+async def main():
+    files = int(sys.argv[1]) if len(sys.argv) > 1 else 64
+    size = (int(sys.argv[2]) if len(sys.argv) > 2 else 16) * 2**20
+    with TemporaryDirectory(dir=sys.argv[3] if len(sys.argv) > 3 else None) as root:
+        # Threads of `aio.open` linger, run it last
+        for name, func in (("pooled", pooled), ("pwrite", positional),
+                           ("aio.open", aio_open)):
+            await bench(name, func, files, size, root)
+
+
+DATA = os.urandom(CHUNK)
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,4 +1,12 @@
 import os
+import re
+import json
+import time
+import asyncio
+import hashlib
+import tarfile
+import io
+import httpx
 import pytest
 import http.server
 import threading
@@ -7,17 +15,89 @@ from pathlib import Path
 from tempfile import NamedTemporaryFile, TemporaryDirectory
 from vermils.io import DummyAioFileStream, DummyFileStream
 from vermils.io import aio
-from vermils.io.puller import AsyncPuller, Modifier, MaxRetryReached
+from vermils.io.puller import AsyncPuller, Modifier, MaxRetryReached, PullerCache
+from vermils.io.puller import HostLimit, TokenBucket, WriterPool, BlobStore
+from vermils.io.puller import AIMDController, RetryPolicy, CircuitBreaker, CircuitOpen
+from vermils.io.puller import BandwidthLimiter
+from vermils.io.puller import Checksum, HashFeed, PullerJournal, PullerMetrics
+from vermils.io.puller import ShardedPuller, ShardError, TarSink, UnsafeMemberError
 
 PORT = 18000
 
 
+class RangeHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
+    """Serves files with single byte range support."""
+    log = []
+    accept_ranges = True
+    cache_control = None
+
+    def log_message(self, format, *args):
+        ...
+
+    def send_head(self):
+        self.log.append((self.command, self.path, dict(self.headers)))
+        if m := re.fullmatch(r"/delay/(\d+)(/.*)", self.path):
+            time.sleep(int(m[1]) / 1000)
+            self.path = m[2]
+        self.drip = 0
+        if m := re.fullmatch(r"/drip/(\d+)(/.*)", self.path):
+            self.drip = int(m[1]) / 1000  # Between bytes of the body
+            self.path = m[2]
+        if m := re.fullmatch(r"/status/(\d+)", self.path):
+            self.send_error(int(m[1]))
+            return None
+        path = self.translate_path(self.path)
+        if not os.path.isfile(path):
+            return super().send_head()
+        size = os.path.getsize(path)
+        etag = self.etag(path)
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return None
+        m = re.fullmatch(r"bytes=(\d+)-(\d*)", self.headers.get("Range", ""))
+        f = open(path, "rb")
+        if m is None or not self.accept_ranges \
+                or self.headers.get("If-Range", etag) != etag:
+            self.send_response(200)
+            start, end = 0, size
+        else:
+            start, end = int(m[1]), min(int(m[2] or size - 1) + 1, size)
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end - 1}/{size}")
+        if self.accept_ranges:
+            self.send_header("Accept-Ranges", "bytes")
+        self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(end - start))
+        if self.cache_control:
+            self.send_header("Cache-Control", self.cache_control)
+        self.end_headers()
+        f.seek(start)
+        self.remaining = end - start
+        return f
+
+    @staticmethod
+    def etag(path):
+        st = os.stat(path)
+        return f'"{st.st_size}-{st.st_mtime_ns}"'
+
+    def copyfile(self, source, outputfile):
+        data = source.read(getattr(self, "remaining", -1))
+        if not self.drip:
+            outputfile.write(data)
+            return
+        for i in range(len(data)):
+            outputfile.write(data[i:i + 1])
+            time.sleep(self.drip)
+
+
 @pytest.fixture
 def http_server():
     with TemporaryDirectory() as tmpdir:
         tmpdir = Path(tmpdir)
 
-        class MyHdlr(http.server.SimpleHTTPRequestHandler):
+        class MyHdlr(RangeHTTPRequestHandler):
             def __init__(self, *args, **kw):
                 kw["directory"] = str(tmpdir)
                 super().__init__(*args, **kw)
@@ -25,7 +105,11 @@ def http_server():
         with open(tmpdir / "file", 'w') as f:
             f.write("hello")
 
-        with http.server.HTTPServer(('', PORT), MyHdlr) as httpd:
+        RangeHTTPRequestHandler.log.clear()
+        RangeHTTPRequestHandler.accept_ranges = True
+        RangeHTTPRequestHandler.cache_control = None
+        with http.server.ThreadingHTTPServer(('', PORT), MyHdlr) as httpd:
+            httpd.directory = tmpdir
             thread = threading.Thread(target=httpd.serve_forever)
             thread.start()
             yield httpd
@@ -191,3 +275,917 @@ async def test_aio_puller(http_server):
         async with AsyncPuller() as puller:
             await puller.pull(url, tmpdir / "file-1", overwrite=True)
             await puller.join()
+
+
+async def test_aio_puller_segmented(http_server):
+    data = os.urandom(2**16 + 7)
+    with open(http_server.directory / "blob", "wb") as f:
+        f.write(data)
+    url = f"http://localhost:{PORT}/blob"
+    with TemporaryDirectory() as tmpdir:
+        tmpdir = Path(tmpdir)
+        async with AsyncPuller(segments=4, min_segment_size=2**12) as puller:
+            await puller.pull(url, tmpdir / "blob")
+            await puller.pull(url, tmpdir / "single", segments=1)
+            await puller.join()
+        assert (tmpdir / "blob").read_bytes() == data
+        assert (tmpdir / "single").read_bytes() == data
+        ranges = [h["Range"] for _, _, h in RangeHTTPRequestHandler.log
+                  if "Range" in h]
+        assert len(ranges) == 4
+
+        # Servers without range support fall back to a single stream
+        RangeHTTPRequestHandler.accept_ranges = False
+        RangeHTTPRequestHandler.log.clear()
+        async with AsyncPuller(segments=4, min_segment_size=2**12) as puller:
+            await puller.pull(url, tmpdir / "blob", overwrite=True)
+            await puller.join()
+        assert (tmpdir / "blob").read_bytes() == data
+        assert [c for c, _, _ in RangeHTTPRequestHandler.log] == ["HEAD", "GET"]
+
+
+async def test_aio_puller_resume(http_server):
+    data = os.urandom(2**16)
+    blob = http_server.directory / "blob"
+    blob.write_bytes(data)
+    url = f"http://localhost:{PORT}/blob"
+    etag = RangeHTTPRequestHandler.etag(blob)
+    with TemporaryDirectory() as tmpdir:
+        path = Path(tmpdir) / "blob"
+        part = Path(f"{path}.part")
+        sidecar = Path(f"{part}.json")
+
+        def leave_part(prefix: bytes, etag: str, pieces):
+            part.write_bytes(prefix)
+            sidecar.write_text(json.dumps({
+                "url": url, "etag": etag,
+                "last_modified": None, "pieces": pieces}))
+
+        async with AsyncPuller(resume=True, min_segment_size=1) as puller:
+            # Continue from the validated offset
+            leave_part(data[:1000], etag, [[1000, None]])
+            await puller.pull(url, path)
+            await puller.join()
+            assert path.read_bytes() == data
+            assert not part.exists() and not sidecar.exists()
+            assert RangeHTTPRequestHandler.log[-1][2]["Range"] == "bytes=1000-"
+
+            # Start over when the validator no longer matches
+            leave_part(b"x" * 1000, '"stale"', [[1000, None]])
+            await puller.pull(url, path, overwrite=True)
+            await puller.join()
+            assert path.read_bytes() == data
+
+            # Segmented pulls resume their unfinished ranges only
+            RangeHTTPRequestHandler.log.clear()
+            half = len(data) // 2
+            leave_part(data[:half] + bytes(half), etag,
+                       [[half, half], [half + 10, len(data)]])
+            part.write_bytes(data[:half + 10] + bytes(half - 10))
+            await puller.pull(url, path, overwrite=True, segments=2)
+            await puller.join()
+            assert path.read_bytes() == data
+            ranges = [h["Range"] for _, _, h in RangeHTTPRequestHandler.log
+                      if "Range" in h]
+            assert ranges == [f"bytes={half + 10}-{len(data) - 1}"]
+
+
+async def test_aio_puller_cache(http_server):
+    blob = http_server.directory / "blob"
+    blob.write_bytes(b"v1")
+    url = f"http://localhost:{PORT}/blob"
+    log = RangeHTTPRequestHandler.log
+    with TemporaryDirectory() as tmpdir:
+        path = Path(tmpdir) / "blob"
+        cache = PullerCache(Path(tmpdir) / "cache.db")
+        hits = []
+        async with AsyncPuller(cache=cache) as puller:
+            @puller.on.worker.cache_hit
+            async def on_hit(event, worker, r):
+                hits.append(r and r.status_code)
+
+            # Fresh entries are served without any request
+            RangeHTTPRequestHandler.cache_control = "max-age=60"
+            await puller.pull(url, path)
+            await puller.join()
+            await puller.pull(url, path)
+            await puller.join()
+            assert len(log) == 1 and hits == [None]
+            assert (await cache.get(url)).fresh
+
+            # Stale entries are revalidated
+            RangeHTTPRequestHandler.cache_control = "no-cache"
+            await cache.put(url, path, (await puller.client.get(url)).headers)
+            log.clear()
+            mtime = path.stat().st_mtime_ns
+            await puller.pull(url, path)
+            await puller.join()
+            assert log[-1][2]["If-None-Match"] == RangeHTTPRequestHandler.etag(blob)
+            assert hits == [None, 304] and path.stat().st_mtime_ns == mtime
+
+            blob.write_bytes(b"v2")
+            os.utime(blob, ns=(0, 0))
+            await puller.pull(url, path, segments=2)
+            await puller.join()
+            assert path.read_bytes() == b"v2" and len(hits) == 2
+        await cache.aclose()
+
+
+def test_token_bucket():
+    bucket = TokenBucket(rate=10, burst=2)
+    assert bucket.acquire() == 0
+    assert bucket.acquire() == 0
+    assert 0 < bucket.acquire() <= 0.1
+    with pytest.raises(ValueError):
+        TokenBucket(rate=0)
+
+
+async def test_aio_puller_host_limits(http_server):
+    url = f"http://localhost:{PORT}/file"
+    started = []
+    running = peak = 0
+    async with AsyncPuller(host_limits={
+        "slow": HostLimit(rate=5),
+        "capped": HostLimit(max_workers=1),
+    }) as puller:
+        @puller.on.worker.start
+        async def on_start(event, worker):
+            nonlocal running, peak
+            started.append(worker.key)
+            if worker.key == "capped":
+                running += 1
+                peak = max(peak, running)
+
+        @puller.on.worker.destroy
+        async def on_destroy(event, worker):
+            nonlocal running
+            if worker.key == "capped":
+                running -= 1
+
+        for _ in range(3):
+            await puller.pull(url, None, limit_key="slow")
+        for _ in range(3):
+            await puller.pull(url, None, limit_key="capped")
+        await puller.pull(url, None)
+        await puller.join()
+    # Rate limited jobs don't hold back the others
+    assert started[0] == "slow" and started[-1] == "slow"
+    assert "localhost" in started[:3]
+    assert peak == 1
+
+
+async def test_aio_puller_priority(http_server):
+    url = f"http://localhost:{PORT}/file"
+    started = []
+    async with AsyncPuller(max_workers=1) as puller:
+        @puller.on.worker.start
+        async def on_start(event, worker):
+            started.append(worker.key)
+
+        fts = {}
+        for key in "abcd":
+            fts[key] = await puller.pull(url, None, limit_key=key)
+        await puller.pull(url, None, limit_key="late", deadline=60)
+        await puller.pull(url, None, limit_key="soon", deadline=1)
+        await puller.pull(url, None, limit_key="urgent", priority=1)
+        assert puller.reprioritize(fts["c"], priority=1)
+        assert puller.cancel(fts["b"])
+        await puller.join()
+        assert fts["b"].cancelled()
+        assert not puller.cancel(fts["a"])
+    # Reprioritized jobs keep their place among ties
+    assert started == ["c", "urgent", "soon", "late", "a", "d"]
+
+
+async def test_aio_puller_pull_many(http_server):
+    url = f"http://localhost:{PORT}/file"
+    taken = 0
+
+    async def jobs():
+        nonlocal taken
+        for i in range(20):
+            taken += 1
+            yield url if i % 2 else (url + "/404", None)
+
+    with TemporaryDirectory() as tmpdir:
+        async with AsyncPuller(max_workers=2) as puller:
+            done = 0
+            async for job, ft in puller.pull_many(jobs(), window=4):
+                done += 1
+                assert taken - done < 4  # Source is consumed lazily
+                assert ft.done() and ft.result() is None
+                assert not puller._ft_map
+            assert done == 20
+
+            jobs = [{"url": url, "path": Path(tmpdir) / "file"}]
+            async for job, ft in puller.pull_many(jobs):
+                assert ft.result() == Path(tmpdir) / "file"
+
+        # Failures handled by hooks never finish, they only free their slot
+        async with AsyncPuller(retry_policy=RetryPolicy()) as puller:
+            Modifier.ignore_failure(puller)
+            jobs = [url, url + "/status/404", url]
+            got = [job async for job, ft in puller.pull_many(jobs, window=1)]
+            assert got == [url, url] and not puller._watchers
+
+
+async def test_writer_pool():
+    pool = WriterPool(threads=2, buffer_size=10)
+    with TemporaryDirectory() as tmpdir:
+        paths = [Path(tmpdir) / f"file{i}" for i in range(4)]
+        files = [await pool.open(p).open() for p in paths]
+        for i in range(100):
+            for f in files:
+                await f.write(b"%d," % i)
+        await files[0].seek(0)
+        await files[0].write(b"x")
+        for f in files:
+            await f.close()
+        assert pool.threads == 2
+        expected = b"".join(b"%d," % i for i in range(100))
+        assert paths[0].read_bytes() == b"x" + expected[1:]
+        assert all(p.read_bytes() == expected for p in paths[1:])
+        with pytest.raises(ValueError):
+            pool.open(paths[0], "rb")
+        with pytest.raises(ValueError):
+            await files[0].write(b"closed")
+    await pool.aclose()
+    assert pool.threads == 0
+
+
+async def test_positional_writes(http_server):
+    pool = WriterPool(threads=1, buffer_size=10)
+    with TemporaryDirectory() as tmpdir:
+        path = Path(tmpdir) / "file"
+        async with pool.open_positional(path) as f:
+            await f.allocate(20)
+            head, tail = f.cursor(0), f.cursor(10)
+            for i in range(10):
+                await tail.write(b"b")
+                await head.write(b"a")
+        assert path.read_bytes() == b"a" * 10 + b"b" * 10
+        with pytest.raises(ValueError):
+            await head.write(b"closed")
+    await pool.aclose()
+
+    data = os.urandom(2**16 + 7)
+    with open(http_server.directory / "blob", "wb") as f:
+        f.write(data)
+    url = f"http://localhost:{PORT}/blob"
+    with TemporaryDirectory() as tmpdir:
+        tmpdir = Path(tmpdir)
+        async with AsyncPuller(segments=4, min_segment_size=2**12,
+                               write_strategy="pwrite") as puller:
+            await puller.pull(url, tmpdir / "blob")
+            await puller.pull(url, tmpdir / "single", segments=1)
+            await puller.pull(url, tmpdir / "resumed", segments=1, resume=True)
+            await puller.join()
+        for name in ("blob", "single", "resumed"):
+            assert (tmpdir / name).read_bytes() == data
+    with pytest.raises(ValueError):
+        AsyncPuller(write_strategy="mmap")  # type: ignore[arg-type]
+
+
+async def test_aio_puller_store(http_server):
+    data = os.urandom(2**16)
+    digest = hashlib.sha256(data).hexdigest()
+    for name in ("a", "b"):
+        (http_server.directory / name).write_bytes(data)
+    url = f"http://localhost:{PORT}"
+    log = RangeHTTPRequestHandler.log
+    with TemporaryDirectory() as tmpdir:
+        tmpdir = Path(tmpdir)
+        store = BlobStore(tmpdir / "store")
+        async with AsyncPuller(store=store, min_segment_size=2**12) as puller:
+            await puller.pull(f"{url}/a", tmpdir / "a")
+            await puller.pull(f"{url}/b", tmpdir / "b", segments=4)
+            await puller.pull(f"{url}/b", tmpdir / "c", resume=True)
+            await puller.join()
+            for name in "abc":
+                assert (tmpdir / name).read_bytes() == data
+            assert store.has(digest)
+            blobs = [p for p in (tmpdir / "store").rglob("*") if p.is_file()]
+            assert blobs == [Path(store.blob(digest))]
+            assert not (tmpdir / "c.part.json").exists()
+
+            # Known digests are linked without pulling
+            log.clear()
+            await puller.pull(f"{url}/missing", tmpdir / "d", digest=digest)
+            await puller.join()
+            assert (tmpdir / "d").read_bytes() == data and not log
+
+
+async def test_aio_puller_checksum(http_server):
+    data = os.urandom(2**18)
+    sha256 = hashlib.sha256(data).hexdigest()
+    (http_server.directory / "blob").write_bytes(data)
+    url = f"http://localhost:{PORT}/blob"
+    feed = HashFeed(["md5"])
+    for i in range(0, len(data), 2**17):
+        await feed.update(data[i:i + 2**17])
+    await feed.finish()
+    assert feed.hexdigest("md5") == hashlib.md5(data).hexdigest()
+    assert feed.size == len(data)
+
+    with TemporaryDirectory() as tmpdir:
+        tmpdir = Path(tmpdir)
+        retries = []
+        async with AsyncPuller(retry=1, min_segment_size=2**12) as puller:
+            @puller.on.worker.retry
+            async def on_retry(event, worker, e, retry):
+                retries.append(type(e).__name__)
+
+            await puller.pull(url, tmpdir / "ok", checksum={
+                "sha256": sha256.upper(), "size": len(data)})
+            await puller.pull(url, tmpdir / "split", segments=4,
+                              checksum=Checksum(md5=hashlib.md5(data).hexdigest()))
+            await puller.pull(url, None, checksum={"size": len(data)})
+            await puller.join()
+            assert (tmpdir / "ok").read_bytes() == data
+            assert (tmpdir / "split").read_bytes() == data
+            assert not retries
+
+            # Mismatches are retried, then the corrupt body is dropped
+            with pytest.raises(MaxRetryReached):
+                await puller.pull(url, tmpdir / "bad", checksum={"sha256": "0" * 64})
+                await puller.join()
+            assert retries == ["ChecksumMismatch"]
+            assert not (tmpdir / "bad").exists()
+    with pytest.raises(ValueError):
+        Checksum(nohash="0")
+
+
+async def test_aio_puller_sinks(http_server):
+    body = os.urandom(2**18)
+    (http_server.directory / "blob").write_bytes(body)
+    url = f"http://localhost:{PORT}/blob"
+    async with AsyncPuller() as puller:
+        data = await (await puller.pull(url, None, sink="memory"))
+        assert isinstance(data, bytearray) and data == body
+        checked = await puller.pull(url, None, sink="memory", checksum=Checksum(
+            size=len(body), sha256=hashlib.sha256(body).hexdigest()))
+        assert await checked == body
+
+        chunks = []
+
+        async def consume(chunk: bytes):
+            chunks.append(chunk)
+
+        assert await (await puller.pull(url, None, sink=consume)) is None
+        assert b"".join(chunks) == body
+        with pytest.raises(ValueError):
+            await puller.pull(url, "file", sink="memory")
+        with pytest.raises(ValueError):
+            await puller.pull(url, None, sink="disk")
+
+
+async def test_aio_puller_postprocess(http_server):
+    (http_server.directory / "blob").write_bytes(b"blob")
+    url = f"http://localhost:{PORT}/blob"
+    with TemporaryDirectory() as tmpdir:
+        tmpdir = Path(tmpdir)
+        async with AsyncPuller(postprocess=os.path.getsize,
+                               postprocess_workers=2) as puller:
+            futures = [await puller.pull(url, tmpdir / f"{i}") for i in range(3)]
+            futures.append(await puller.pull(url, None, sink="memory",
+                                             postprocess=bytearray.upper))
+            await puller.join()
+            assert [f.result() for f in futures] == [4, 4, 4, b"BLOB"]
+            assert puller.running == 0
+            with pytest.raises(NotADirectoryError):
+                await puller.pull(url, tmpdir / "file", postprocess=os.rmdir)
+                await puller.join()
+        assert puller._post_executor is None
+
+        # Failures of the stage go through the hooks like any other
+        metrics = PullerMetrics()
+        async with AsyncPuller(metrics=metrics, overwrite=True) as puller:
+            failed = []
+
+            @puller.on.worker.fail
+            async def on_fail(event, worker, e):
+                failed.append(type(e))
+                return True
+
+            await puller.pull(url, tmpdir / "file", postprocess=os.rmdir)
+            await puller.join()
+            assert failed == [NotADirectoryError]
+            host = metrics.snapshot()["hosts"]["localhost"]
+            assert host["failed"] == 1 and host["succeeded"] == 0
+
+
+async def test_aio_puller_tar_sink(http_server):
+    def archive(members: dict[str, bytes], mode: str = "w:gz") -> bytes:
+        buffer = io.BytesIO()
+        with tarfile.open(fileobj=buffer, mode=mode) as tar:
+            for name, data in members.items():
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                tar.addfile(info, io.BytesIO(data))
+        return buffer.getvalue()
+
+    body = os.urandom(2**18)
+    (http_server.directory / "a.tar.gz").write_bytes(
+        archive({"a.txt": b"a", "sub/b.bin": body}))
+    (http_server.directory / "a.tar.xz").write_bytes(
+        archive({"c.txt": b"c"}, "w:xz"))
+    (http_server.directory / "evil.tar").write_bytes(
+        archive({"../evil.txt": b"evil"}, "w"))
+    url = f"http://localhost:{PORT}"
+    with TemporaryDirectory() as tmpdir:
+        tmpdir = Path(tmpdir)
+        out = tmpdir / "out"
+        sink = TarSink(out, max_buffered=2**10)
+        async with AsyncPuller() as puller:
+            assert await (await puller.pull(f"{url}/a.tar.gz", None, sink=sink)) \
+                == str(out)
+            await (await puller.pull(f"{url}/a.tar.xz", None, sink=sink))
+            assert (out / "a.txt").read_bytes() == b"a"
+            assert (out / "sub" / "b.bin").read_bytes() == body
+            assert (out / "c.txt").read_bytes() == b"c"
+            with pytest.raises(UnsafeMemberError):
+                await puller.pull(f"{url}/evil.tar", None, sink=sink)
+                await puller.join()
+        assert not (tmpdir / "evil.txt").exists()
+
+
+async def test_aio_puller_coalesce(http_server):
+    (http_server.directory / "blob").write_bytes(b"blob")
+    url = f"http://localhost:{PORT}"
+    log = RangeHTTPRequestHandler.log
+    log.clear()
+    with TemporaryDirectory() as tmpdir:
+        tmpdir = Path(tmpdir)
+        async with AsyncPuller(coalesce=True, retry_policy=RetryPolicy()) as puller:
+            futures = [await puller.pull(f"{url}/blob", tmpdir / f"{i}")
+                       for i in range(3)]
+            futures.append(await puller.pull(f"{url}/blob", None))
+            others = [
+                await puller.pull(f"{url}/blob", None, extra_headers={"X-Other": "1"}),
+                await puller.pull(f"{url}/blob", None, auth=("user", "pass")),
+                await puller.pull(f"{url}/blob", None, checksum={"size": 4}),
+            ]
+            await puller.join()
+            assert [f.result() for f in futures] == [
+                tmpdir / "0", tmpdir / "1", tmpdir / "2", None]
+            assert all(f.done() for f in others) and len(log) == 4
+            assert sum("Authorization" in headers for *_, headers in log) == 1
+            assert {(tmpdir / f"{i}").read_bytes() for i in range(3)} == {b"blob"}
+            assert not puller._flights
+
+            # Existing paths don't lead, their failure is their own
+            existing = await puller.pull(f"{url}/blob", tmpdir / "0")
+            fresh = await puller.pull(f"{url}/blob", tmpdir / "3")
+            with pytest.raises(FileExistsError):
+                await puller.join()
+            assert isinstance(existing.exception(), FileExistsError)
+            assert fresh.result() == tmpdir / "3"
+
+            # Followers share the failure, handled by hooks like any other
+            failed = []
+
+            @puller.on.worker.fail
+            async def on_fail(event, worker, e):
+                failed.append(worker.future)
+                return True
+
+            leader = await puller.pull(f"{url}/status/404", None)
+            follower = await puller.pull(f"{url}/status/404", None)
+            await puller.join()
+            assert failed == [leader, follower] and not follower.done()
+
+        # Cancelled pulls leave the transfer to the others, the last one ends it
+        log.clear()
+        async with AsyncPuller(max_workers=1, coalesce=True) as puller:
+            busy = await puller.pull(f"{url}/delay/300/blob", None)
+            first = await puller.pull(f"{url}/blob", tmpdir / "c0")
+            second = await puller.pull(f"{url}/blob", tmpdir / "c1")
+            third = await puller.pull(f"{url}/blob", None)
+            alone = await puller.pull(f"{url}/file", None)
+            assert puller.cancel(first) and puller.cancel(third)
+            assert puller.cancel(alone)
+            await puller.join()
+            assert first.cancelled() and third.cancelled() and alone.cancelled()
+            assert busy.done() and second.result() == tmpdir / "c1"
+            assert (tmpdir / "c1").read_bytes() == b"blob"
+            assert not (tmpdir / "c0").exists()
+            assert [path for _, path, _ in log].count("/blob") == 1
+            assert not puller._flights
+
+
+async def test_aio_puller_hedged(http_server):
+    (http_server.directory / "blob").write_bytes(b"blob")
+    url = f"http://localhost:{PORT}"
+    with TemporaryDirectory() as tmpdir:
+        tmpdir = Path(tmpdir)
+        async with AsyncPuller(retry_policy=RetryPolicy(), min_chunk_size=1,
+                               progress_interval=0) as puller:
+            # The slow primary is raced and loses
+            since = time.monotonic()
+            await (await puller.pull(f"{url}/delay/3000/blob", tmpdir / "a",
+                                     mirrors=[f"{url}/blob"], hedge_delay=0.1))
+            assert time.monotonic() - since < 2
+            assert (tmpdir / "a").read_bytes() == b"blob"
+            # Streaming racers hold back further hedges
+            log = RangeHTTPRequestHandler.log
+            log.clear()
+            data = await (await puller.pull(
+                f"{url}/delay/150/drip/100/blob", None, sink="memory",
+                mirrors=[f"{url}/delay/2000/blob", f"{url}/blob"], hedge_delay=0.1))
+            assert data == b"blob"
+            assert [path for _, path, _ in log] == [
+                "/delay/150/drip/100/blob", "/delay/2000/blob"]
+
+            # Progress follows the leading racer only, chunks are still emitted
+            progress, chunks = [], []
+
+            @puller.on.worker.progress
+            async def on_progress(event, worker, downloaded, total):
+                progress.append((downloaded, total))
+
+            @puller.on.worker.bytes_get
+            async def on_bytes(event, worker, r, chunk):
+                chunks.append(chunk)
+
+            data = await (await puller.pull(
+                f"{url}/drip/100/blob", None, sink="memory",
+                mirrors=[f"{url}/drip/20/blob"], hedge_delay=0.05, hedge_rate=1e6))
+            assert data == b"blob" and len(chunks) >= 2  # From both racers
+            assert progress[-1] == (4, 4)
+
+        # The first byte counts, not the first buffered chunk
+        (http_server.directory / "slow").write_bytes(b"s" * 300)
+        log.clear()
+        async with AsyncPuller(retry_policy=RetryPolicy()) as puller:
+            data = await (await puller.pull(
+                f"{url}/drip/2/slow", None, sink="memory",
+                mirrors=[f"{url}/slow"], hedge_delay=0.3))
+            assert data == b"s" * 300
+            assert [path for _, path, _ in log] == ["/drip/2/slow"]
+            assert all(downloaded <= total for downloaded, total in progress)
+            puller.event_hooks["worker.progress"].clear()
+            puller.event_hooks["worker.bytes_get"].clear()
+            # Mirrors take over failures without a delay
+            data = await (await puller.pull(
+                f"{url}/status/404", None, sink="memory",
+                mirrors=[f"{url}/status/503", f"{url}/blob"]))
+            assert data == b"blob"
+            with pytest.raises(httpx.HTTPStatusError):
+                await puller.pull(f"{url}/status/404", None, retry=0,
+                                  mirrors=[f"{url}/status/404"])
+                await puller.join()
+        assert os.listdir(tmpdir) == ["a"]
+
+
+async def test_aio_puller_as_completed(http_server):
+    (http_server.directory / "blob").write_bytes(b"blob")
+    url = f"http://localhost:{PORT}"
+    async with AsyncPuller(retry_policy=RetryPolicy()) as puller:
+        assert [f async for f in puller.as_completed()] == []
+        # Successes are released at once, awaited or not
+        await (await puller.pull(f"{url}/blob", None, sink="memory"))
+        assert not puller._ft_map
+
+        for _ in range(3):
+            await puller.pull(f"{url}/delay/100/blob", None)
+        await puller.pull(f"{url}/status/404", None)
+        await asyncio.sleep(0.05)  # Failures are kept until yielded
+        results, errors = [], []
+        async for future in puller.as_completed():
+            if future.exception() is not None:
+                errors.append(future.exception())
+            else:
+                results.append(future.result())
+            if len(results) + len(errors) == 1:
+                await puller.pull(f"{url}/delay/100/blob", None)  # Pulled meanwhile
+        assert len(results) == 4 and len(errors) == 1
+        assert not puller._ft_map and not puller._watchers
+        await puller.join()  # Released, nothing raised
+
+        Modifier.ignore_failure(puller)
+        await puller.pull(f"{url}/status/404", None)
+        assert [f async for f in puller.as_completed()] == []
+
+
+async def test_aio_puller_progress(http_server):
+    data = os.urandom(2**20)
+    (http_server.directory / "blob").write_bytes(data)
+    url = f"http://localhost:{PORT}/blob"
+    reports = []
+    async with AsyncPuller(progress_bytes=2**19, progress_interval=60,
+                           min_segment_size=2**12) as puller:
+        @puller.on.worker.progress
+        async def on_progress(event, worker, downloaded, total):
+            reports.append((worker.segments, downloaded, total))
+
+        await puller.pull(url, None)
+        await puller.pull(url, None, segments=4)
+        await puller.join()
+    single = [r for r in reports if r[0] == 1]
+    split = [r for r in reports if r[0] == 4]
+    # Coalesced to about one per 512 KiB, plus the final one
+    for reported in (single, split):
+        assert 2 <= len(reported) <= 3
+        assert reported[-1][1:] == (2**20, 2**20)
+        assert [d for _, d, _ in reported] == sorted(d for _, d, _ in reported)
+
+
+async def test_aio_puller_chunk_size(http_server):
+    (http_server.directory / "tiny").write_bytes(b"x" * 100)
+    (http_server.directory / "blob").write_bytes(os.urandom(2**22))
+    url = f"http://localhost:{PORT}"
+    sizes: dict[str, list[int]] = {}
+    async with AsyncPuller(min_chunk_size=2**12, max_chunk_size=2**18) as puller:
+        @puller.on.worker.bytes_get
+        async def on_bytes(event, worker, r, chunk):
+            sizes.setdefault(worker.url, []).append(len(chunk))
+
+        await puller.pull(f"{url}/tiny", None)
+        await puller.pull(f"{url}/blob", None)
+        await puller.join()
+    assert sizes[f"{url}/tiny"] == [100]
+    blob = sizes[f"{url}/blob"]
+    assert sum(blob) == 2**22
+    # Grows past the lower bound on a fast link, bounded by the upper one
+    assert max(blob) > 2**12 and max(blob[:-1]) < 2**18 + 2**16
+
+
+async def test_aimd_controller(http_server):
+    url = f"http://localhost:{PORT}"
+    (http_server.directory / "blob").write_bytes(os.urandom(2**16))
+    controller = AIMDController(min_workers=2, max_workers=16, interval=0)
+    decisions = []
+    async with AsyncPuller(max_workers=8, concurrency=controller) as puller:
+        @puller.on.puller.concurrency
+        async def on_decision(event, puller, limit, reason):
+            decisions.append((limit, reason))
+
+        # Back off on overloaded remotes, down to the lower bound
+        for _ in range(3):
+            await puller.pull(f"{url}/status/503", None)
+            await puller.join()
+        assert decisions[:2] == [(4, "decrease"), (2, "decrease")]
+        assert puller.max_workers == 2
+
+        # Grow while saturated and throughput rises
+        decisions.clear()
+        controller.rate = 0
+        await asyncio.gather(*[
+            await puller.pull(f"{url}/blob", None) for _ in range(4)])
+        assert decisions and decisions[0] == (3, "increase")
+    assert puller.downloaded >= 4 * 2**16
+
+
+def test_bandwidth_limiter():
+    limiter = BandwidthLimiter(rate=1000, per_host=500, burst=0)
+    assert limiter.reserve("a", 100) == pytest.approx(0.2, abs=0.01)
+    # Reservations of one flow wait behind each other
+    assert limiter.reserve("b", 100) == pytest.approx(0.2, abs=0.01)
+    assert limiter.reserve("a", 100) == pytest.approx(0.4, abs=0.01)
+    limiter.per_host = None
+    assert limiter.reserve("a", 100) == pytest.approx(0.4, abs=0.01)
+    limiter.rate = None
+    assert limiter.reserve("a", 10**9) == 0
+    with pytest.raises(ValueError):
+        limiter.rate = 0
+    # Active flows get even shares, which return once they leave
+    limiter = BandwidthLimiter(per_host=500, burst=0)
+    with limiter.flow("c", "x"), limiter.flow("c", "y"):
+        assert limiter.reserve("c", 100, "x") == pytest.approx(0.4, abs=0.01)
+        assert limiter.reserve("c", 100, "y") == pytest.approx(0.4, abs=0.01)
+    assert limiter.reserve("c", 100, "x") == pytest.approx(0.2, abs=0.01)
+
+
+async def test_aio_puller_bandwidth(http_server):
+    (http_server.directory / "blob").write_bytes(os.urandom(2**18))
+    url = f"http://localhost:{PORT}/blob"
+    limiter = BandwidthLimiter(rate=2**20, burst=2**16)
+    async with AsyncPuller(bandwidth=limiter) as puller:
+        since = time.monotonic()
+        for _ in range(2):
+            await puller.pull(url, None)
+        await puller.join()
+        assert time.monotonic() - since >= 0.4  # (2**19 - 2**16) / 2**20
+
+
+async def test_bandwidth_fair_share():
+    limiter = BandwidthLimiter(rate=2**22, burst=0)
+    received = {}
+
+    async def read(name, chunk):
+        received[name] = 0
+        with limiter.flow("host", name):
+            while time.monotonic() < end:
+                received[name] += chunk
+                await limiter.throttle("host", chunk, name)
+
+    # Small chunks are not crowded out by large ones
+    end = time.monotonic() + 1
+    await asyncio.gather(read("large", 2**20), read("small", 2**16))
+    assert received["small"] >= 2**20
+    assert 0.5 < received["large"] / received["small"] < 2
+
+
+def test_retry_policy():
+    policy = RetryPolicy(base=1, cap=10)
+    request = httpx.Request("GET", "http://localhost/")
+
+    def status_error(status, **headers):
+        r = httpx.Response(status, headers=headers, request=request)
+        return httpx.HTTPStatusError("", request=request, response=r)
+
+    assert policy.retryable(status_error(503))
+    assert not policy.retryable(status_error(404))
+    assert policy.retryable(httpx.ConnectTimeout(""))
+    assert not policy.retryable(httpx.UnsupportedProtocol(""))
+    assert not policy.retryable(ValueError())
+    last = 0
+    for retry in range(1, 20):
+        wait = policy.delay(httpx.ConnectError(""), retry, last)
+        assert 1 <= wait <= min(10, max(last, 1) * 3)
+        last = wait
+    assert policy.delay(status_error(429, **{"Retry-After": "20"}), 1) == 20
+    legacy = RetryPolicy(jitter=False, retry_after=False, statuses=None, fatal=())
+    assert legacy.retryable(status_error(404)) and not legacy.raises(404)
+    assert legacy.delay(status_error(429, **{"Retry-After": "20"}), 2) == 1.7 ** 2
+
+    breaker = CircuitBreaker(threshold=2, cooldown=0)
+    assert not breaker.failure("a") and breaker.failure("a")
+    assert breaker.state("a") == "half-open" and breaker.delay("a") == 0
+    breaker.acquire("a")
+    assert breaker.delay("a") > 0
+    breaker.success("a")
+    assert breaker.state("a") == "closed"
+
+
+async def test_aio_puller_circuit_breaker(http_server):
+    url = f"http://localhost:{PORT}"
+    log = RangeHTTPRequestHandler.log
+    breaker = CircuitBreaker(threshold=2, cooldown=60, fail_fast=True)
+    policy = RetryPolicy(base=0.01, cap=0.01, breaker=breaker)
+    async with AsyncPuller(max_workers=1, retry=1, retry_policy=policy) as puller:
+        Modifier.ignore_failure(puller)
+        # Error responses outside `statuses` fail at once
+        await puller.pull(f"{url}/status/404", None)
+        await puller.join()
+        assert len(log) == 1 and breaker.state("localhost") == "closed"
+
+        # The breaker opens and fails the queued jobs of the host,
+        # through the fail hooks like any other failure
+        failures = []
+
+        @puller.on.worker.fail
+        async def on_fail(event, worker, e):
+            failures.append(type(e))
+
+        log.clear()
+        for _ in range(3):
+            await puller.pull(f"{url}/status/503", None)
+        await puller.join()
+        assert len(log) == 2 and breaker.state("localhost") == "open"
+        assert failures == [MaxRetryReached, CircuitOpen, CircuitOpen]
+        assert not puller._ft_map
+
+    async with AsyncPuller(retry_policy=policy) as puller:
+        future = await puller.pull(f"{url}/status/503", None)
+        with pytest.raises(CircuitOpen):
+            await puller.join()
+        assert isinstance(future.exception(), CircuitOpen)
+
+
+async def test_aio_puller_aggregate_progress(http_server):
+    from rich.progress import Progress
+    (http_server.directory / "blob").write_bytes(b"blob")
+    url = f"http://localhost:{PORT}"
+    progress = Progress(disable=True)
+    async with AsyncPuller(max_workers=2, retry_policy=RetryPolicy()) as puller:
+        Modifier.ignore_failure(puller)
+        Modifier.show_progress(puller, progress=progress, aggregate=True,
+                               top=2, sample_interval=0.01)
+        for _ in range(5):
+            await puller.pull(f"{url}/blob", None)
+        await puller.pull(f"{url}/status/404", None)
+        await puller.join()
+        await asyncio.sleep(0.05)  # Last sample
+    files, size, *slots = progress.tasks
+    assert len(slots) == 2 and not any(t.visible for t in slots)
+    assert files.completed == files.total == 6
+    assert files.description == "Files (1 failed)"
+    assert size.completed == 20
+
+
+async def test_aio_puller_metrics(http_server):
+    (http_server.directory / "blob").write_bytes(b"blob")
+    url = f"http://localhost:{PORT}"
+    metrics = PullerMetrics()
+    policy = RetryPolicy(base=0.01, cap=0.01)
+    async with AsyncPuller(retry=1, retry_policy=policy, metrics=metrics) as puller:
+        Modifier.ignore_failure(puller)
+        for _ in range(3):
+            await puller.pull(f"{url}/blob", None)
+        await puller.pull(f"{url}/status/503", None)
+        await puller.pull(f"{url}/status/404", None)
+        await puller.join()
+        snap = metrics.snapshot()
+        assert snap["queue_depth"] == snap["active_workers"] == 0
+        assert snap["bytes_total"] == 12 and snap["bytes_per_second"] > 0
+        host = snap["hosts"]["localhost"]
+        assert host["succeeded"] == 3 and host["failed"] == 2
+        assert host["retries"] == {"503": 1}
+        assert host["failures"] == {"MaxRetryReached": 1, "404": 1}
+        assert host["duration"]["count"] == 3 and host["ttfb"]["count"] == 5
+        assert host["ttfb"]["buckets"][-1] == (float("inf"), 5)
+        text = metrics.render()
+        assert 'puller_jobs_total{host="localhost",outcome="success"} 3' in text
+        assert 'puller_retries_total{host="localhost",reason="503"} 1' in text
+        assert 'puller_ttfb_seconds_bucket{host="localhost",le="+Inf"} 5' in text
+        assert "# TYPE puller_duration_seconds histogram" in text
+
+
+async def test_sharded_puller(http_server):
+    (http_server.directory / "blob").write_bytes(b"blob")
+    url = f"http://localhost:{PORT}"
+    with TemporaryDirectory() as tmpdir:
+        tmpdir = Path(tmpdir)
+        async with ShardedPuller(2, retry_policy=RetryPolicy()) as puller:
+            assert puller.shard_of(url) == puller.shard_of(f"{url}/x")
+            started = []
+
+            @puller.on.worker.start
+            async def on_start(event, shard_event):
+                started.append(shard_event.shard)
+
+            futures = [await puller.pull(f"{url}/blob", tmpdir / f"{i}",
+                                         limit_key=f"key{i}") for i in range(4)]
+            assert await asyncio.gather(*futures) == [
+                str(tmpdir / f"{i}") for i in range(4)]
+            assert {(tmpdir / f"{i}").read_bytes() for i in range(4)} == {b"blob"}
+            with pytest.raises(ShardError, match="HTTPStatusError"):
+                await puller.pull(f"{url}/status/404", None)
+                await puller.join()
+        assert sorted(started) == sorted(
+            [puller.shard_of(url, f"key{i}") for i in range(4)]
+            + [puller.shard_of(url)])
+
+    # Jobs of dead shards fail, bad arguments are refused up front
+    puller = ShardedPuller(1, write_strategy="mmap")
+    with pytest.raises(ValueError, match="sent to shards"):
+        await puller.pull(f"{url}/blob", None, sink=lambda chunk: None)
+    future = await puller.pull(f"{url}/blob", None)
+    with pytest.raises(ShardError, match="exit code 1"):
+        await asyncio.wait_for(future, 30)
+    with pytest.raises(ShardError):
+        await (await puller.pull(f"{url}/blob", None))
+    with pytest.raises(ShardError):
+        await asyncio.wait_for(puller.aclose(), 30)
+
+
+async def test_aio_puller_journal(http_server):
+    (http_server.directory / "blob").write_bytes(b"blob")
+    url = f"http://localhost:{PORT}/blob"
+    with TemporaryDirectory() as tmpdir:
+        tmpdir = Path(tmpdir)
+        db = tmpdir / "jobs.db"
+        # Left by a crashed run
+        journal = await PullerJournal(db, flush_interval=60, keep_secrets=True).open()
+        journal.add(url, tmpdir / "a", {"retry": 1, "timeout": httpx.Timeout(5, read=3),
+                                        "auth": ("user", "pass")})
+        running = journal.add(url, tmpdir / "b", {
+            "checksum": Checksum(size=4),
+            "extra_headers": httpx.Headers({"Authorization": "token"}),
+            "extra_cookies": httpx.Cookies({"c": "1"}),
+            "extra_params": httpx.QueryParams("q=1&q=2")})
+        journal.update(running, "running")
+        journal.update(journal.add(url, tmpdir / "c", {}), "done")
+        # Credentials are left out by default, their jobs can't be recovered
+        journal.keep_secrets = False
+        journal.add(url, tmpdir / "d", {"auth": ("user", "secret")})
+        journal.add(url, tmpdir / "e", {"extra_headers": object()})
+        await journal.aclose()
+
+        async with AsyncPuller(journal=db) as puller:
+            a, b, d, e = await puller.journal.unfinished()
+            assert a.options["timeout"] == httpx.Timeout(5, read=3)
+            assert a.options["auth"] == ("user", "pass")
+            assert b.options["checksum"].size == 4
+            assert b.options["extra_headers"]["authorization"] == "token"
+            assert b.options["extra_cookies"]["c"] == "1"
+            assert b.options["extra_params"].get_list("q") == ["1", "2"]
+            assert d.options is None and e.options is None
+            futures = await puller.recover()
+            assert len(futures) == 2
+            await asyncio.gather(*futures)
+            await puller.pull(url, None, timeout=httpx.Timeout(5))
+            # Options that can't be journaled don't fail the pull
+            await puller.pull(url, None, auth=httpx.BasicAuth("user", "secret"),
+                              extra_headers=httpx.Headers({"X-A": "1"}),
+                              extra_cookies=httpx.Cookies({"c": "1"}))
+            await puller.join()
+            assert (tmpdir / "a").read_bytes() == (tmpdir / "b").read_bytes() == b"blob"
+            assert not (tmpdir / "d").exists()
+            assert await puller.journal.counts() == {
+                "done": 5, "superseded": 2, "failed": 2}
+            assert await puller.journal.unfinished() == []
+        assert puller.journal._db is None  # Closed with the puller
+        assert b"secret" not in b"".join(
+            path.read_bytes() for path in tmpdir.glob("jobs.db*"))
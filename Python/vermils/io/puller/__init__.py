@@ -1,5 +1,23 @@
 from . import pullers
+from .cache import CacheEntry, PullerCache
+from .journal import PullerJournal, JournalEntry
+from .limiters import HostLimit, TokenBucket, AIMDController, BandwidthLimiter
+from .metrics import Histogram, HostMetrics, PullerMetrics
+from .checksums import Checksum, ChecksumMismatch, HashFeed
+from .retry import RetryPolicy, CircuitBreaker, CircuitOpen
+from .store import BlobStore
+from .sinks import MemorySink, CallbackSink, TarSink, UnsafeMemberError
+from .writers import WriterPool, PooledFile, PositionalFile, FileCursor
+from .sharded import ShardedPuller, ShardEvent, ShardError
 from .modifier import Modifier
 from .pullers import *
 
-__all__ = pullers.__all__ + ("Modifier", )
+__all__ = pullers.__all__ + (
+    "CacheEntry", "PullerCache", "PullerJournal", "JournalEntry",
+    "HostLimit", "TokenBucket", "AIMDController", "BandwidthLimiter",
+    "Histogram", "HostMetrics", "PullerMetrics",
+    "Checksum", "ChecksumMismatch", "HashFeed", "BlobStore",
+    "MemorySink", "CallbackSink", "TarSink", "UnsafeMemberError",
+    "RetryPolicy", "CircuitBreaker", "CircuitOpen",
+    "WriterPool", "PooledFile", "PositionalFile", "FileCursor",
+    "ShardedPuller", "ShardEvent", "ShardError", "Modifier", )
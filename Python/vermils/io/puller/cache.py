@@ -0,0 +1,165 @@
+"""HTTP Cache Index for Pullers"""
+from __future__ import annotations
+import os
+import time
+import sqlite3
+from email.utils import parsedate_to_datetime
+from httpx import Headers
+from ...asynctools import AsinkRunner
+
+__all__ = ("CacheEntry", "PullerCache")
+
+
+class CacheEntry:
+    """A pulled file and the validators it was served with."""
+
+    __slots__ = ("url", "path", "etag", "last_modified", "expires")
+
+    def __init__(self, url: str, path: str, etag: str | None,
+                 last_modified: str | None, expires: float):
+        self.url = url
+        self.path = path
+        self.etag = etag
+        self.last_modified = last_modified
+        self.expires = expires
+        """Epoch time after which the entry must be revalidated"""
+
+    @property
+    def fresh(self) -> bool:
+        """Whether the entry can be served without asking the server."""
+        return time.time() < self.expires
+
+    @property
+    def conditions(self) -> dict[str, str]:
+        """Headers for a conditional request."""
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+    def __repr__(self) -> str:
+        return f"CacheEntry({self.url}, {self.path})"
+
+
+def _expires(headers: Headers, now: float) -> float | None:
+    """
+    Epoch time the response stays fresh until.
+    Returns `None` if the response must not be stored.
+    """
+    cc: dict[str, str] = {}
+    for directive in headers.get("Cache-Control", "").split(","):
+        k, _, v = directive.partition("=")
+        cc[k.strip().lower()] = v.strip().strip('"')
+    if "no-store" in cc:
+        return None
+    if "no-cache" in cc:
+        return now
+    try:
+        if "max-age" in cc:
+            return now + int(cc["max-age"]) - int(headers.get("Age", 0))
+        if "Expires" in headers:
+            expires = parsedate_to_datetime(headers["Expires"]).timestamp()
+            date = parsedate_to_datetime(headers["Date"]).timestamp() \
+                if "Date" in headers else now
+            return now + expires - date
+    except (ValueError, TypeError):
+        pass
+    return now  # No explicit freshness, always revalidate
+
+
+class PullerCache:
+    """
+    # PullerCache Class
+    An on-disk index of pulled files keyed by URL, backed by SQLite.
+
+    Every query runs in one `AsinkRunner` thread that owns the connection.
+    """
+
+    def __init__(self, path: str | os.PathLike = ":memory:"):
+        """
+        * `path` - path of the SQLite database
+        """
+        self.path = os.fspath(path)
+        self._sink = AsinkRunner()
+        self._db: sqlite3.Connection | None = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._db is None:
+            self._db = sqlite3.connect(self.path)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "url TEXT PRIMARY KEY, path TEXT NOT NULL, etag TEXT, "
+                "last_modified TEXT, expires REAL NOT NULL)")
+        return self._db
+
+    def _get(self, url: str) -> CacheEntry | None:
+        row = self._connect().execute(
+            "SELECT url, path, etag, last_modified, expires "
+            "FROM entries WHERE url = ?", (url,)).fetchone()
+        return CacheEntry(*row) if row else None
+
+    def _put(self, url: str, path: str, headers: Headers) -> None:
+        db = self._connect()
+        now = time.time()
+        expires = _expires(headers, now)
+        with db:
+            if expires is None or not (
+                    "ETag" in headers or "Last-Modified" in headers
+                    or expires > now):
+                db.execute("DELETE FROM entries WHERE url = ?", (url,))
+                return
+            db.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)",
+                (url, path, headers.get("ETag"),
+                 headers.get("Last-Modified"), expires))
+
+    def _refresh(self, url: str, headers: Headers) -> None:
+        expires = _expires(headers, time.time())
+        with self._connect() as db:
+            if expires is None:
+                db.execute("DELETE FROM entries WHERE url = ?", (url,))
+                return
+            db.execute(
+                "UPDATE entries SET expires = ?, "
+                "etag = coalesce(?, etag), "
+                "last_modified = coalesce(?, last_modified) WHERE url = ?",
+                (expires, headers.get("ETag"),
+                 headers.get("Last-Modified"), url))
+
+    def _remove(self, url: str) -> None:
+        with self._connect() as db:
+            db.execute("DELETE FROM entries WHERE url = ?", (url,))
+
+    def _close(self) -> None:
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    async def get(self, url: str) -> CacheEntry | None:
+        """Get the entry of `url`."""
+        return await self._sink.run(self._get, url)
+
+    async def put(self, url: str, path: str, headers: Headers) -> None:
+        """Store `path` as the body of `url` served with `headers`."""
+        await self._sink.run(self._put, url, os.fspath(path), headers)
+
+    async def refresh(self, url: str, headers: Headers) -> None:
+        """Update the entry of `url` from a `304 Not Modified` response."""
+        await self._sink.run(self._refresh, url, headers)
+
+    async def remove(self, url: str) -> None:
+        """Forget the entry of `url`."""
+        await self._sink.run(self._remove, url)
+
+    async def aclose(self) -> None:
+        """Close the database."""
+        if not self._sink.closed:
+            await self._sink.run(self._close)
+            await self._sink.aclose()
+
+    def __repr__(self) -> str:
+        return f"PullerCache({self.path})"
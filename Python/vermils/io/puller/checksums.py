@@ -0,0 +1,105 @@
+"""Streaming Checksums for Pullers"""
+from __future__ import annotations
+import os
+import asyncio
+import hashlib
+from typing import Any, Iterable, Mapping
+from ...asynctools import async_run
+
+__all__ = ("Checksum", "ChecksumMismatch", "HashFeed")
+
+
+class ChecksumMismatch(Exception):
+    """Raised when a pulled body doesn't match its expected checksum."""
+
+
+class HashFeed:
+    """
+    # HashFeed Class
+    Feeds the chunks of a body to hash objects in order and counts its size.
+
+    Chunks of at least `inline_size` bytes are hashed in a thread,
+    `hashlib` releases the GIL for them, so the event loop keeps serving
+    other pulls. At most one chunk is being hashed at a time.
+    """
+
+    inline_size = 2**16
+    """Smaller chunks are hashed on the event loop, a thread hop costs more"""
+
+    def __init__(self, algorithms: Iterable[str] = ()):
+        self.hashers = {name: hashlib.new(name) for name in algorithms}
+        self.size = 0
+        self._pending: asyncio.Future | None = None
+
+    def feed(self, data: bytes) -> None:
+        """Hash `data` right away."""
+        for h in self.hashers.values():
+            h.update(data)
+
+    async def update(self, data: bytes) -> None:
+        """Hash `data` after the chunks before it."""
+        self.size += len(data)
+        await self.finish()
+        if len(data) < self.inline_size or not self.hashers:
+            self.feed(data)
+        else:
+            self._pending = asyncio.ensure_future(async_run(self.feed, data))
+
+    async def finish(self) -> None:
+        """Wait until every chunk is hashed."""
+        if self._pending is not None:
+            pending, self._pending = self._pending, None
+            await pending
+
+    def hexdigest(self, algorithm: str) -> str:
+        return self.hashers[algorithm].hexdigest()
+
+    @classmethod
+    def of_file(cls, file: str | os.PathLike,
+                algorithms: Iterable[str] = ()) -> HashFeed:
+        """Hash `file` from the start, blocks."""
+        feed = cls(algorithms)
+        with open(file, "rb") as f:
+            while chunk := f.read(2**20):
+                feed.size += len(chunk)
+                feed.feed(chunk)
+        return feed
+
+
+class Checksum:
+    """
+    # Checksum Class
+    Expected size and digests of a body, e.g.
+    `Checksum(size=1024, sha256="...")`.
+
+    Digests are named after `hashlib` algorithms.
+    """
+
+    __slots__ = ("size", "digests")
+
+    def __init__(self, size: int | None = None, **digests: str):
+        for name in digests:
+            hashlib.new(name)  # Fail early on unknown algorithms
+        self.size = size
+        self.digests = {k: v.lower() for k, v in digests.items()}
+
+    @classmethod
+    def of(cls, value: Checksum | Mapping[str, Any]) -> Checksum:
+        """Accept a `Checksum` or a mapping of its arguments."""
+        return value if isinstance(value, Checksum) else cls(**value)
+
+    def verify(self, feed: HashFeed) -> None:
+        """Raise `ChecksumMismatch` unless `feed` hashed the expected body."""
+        if self.size is not None and feed.size != self.size:
+            raise ChecksumMismatch(
+                f"Expected {self.size} bytes, got {feed.size}")
+        for name, expected in self.digests.items():
+            actual = feed.hexdigest(name)
+            if actual != expected:
+                raise ChecksumMismatch(
+                    f"Expected {name} {expected}, got {actual}")
+
+    def __repr__(self) -> str:
+        args = [f"size={self.size}"] if self.size is not None else []
+        args += [f"{k}={v!r}" for k, v in self.digests.items()]
+        return f"Checksum({', '.join(args)})"
@@ -0,0 +1,264 @@
+"""Persistent Job Journal for Pullers"""
+from __future__ import annotations
+import os
+import json
+import time
+import sqlite3
+import asyncio
+from typing import Any, Mapping
+from httpx import Cookies, Headers, QueryParams, Timeout
+from ...asynctools import AsinkRunner
+from .checksums import Checksum
+
+__all__ = ("PullerJournal", "JournalEntry")
+
+UNFINISHED = ("queued", "running")
+SECRET_HEADERS = frozenset(("authorization", "proxy-authorization", "cookie"))
+"""Headers holding credentials, lowercased"""
+ITEMS = (("extra_headers", Headers), ("extra_params", QueryParams),
+         ("extra_cookies", Cookies))
+"""Options journaled as lists of items, with their types"""
+
+
+def _encode(o: Any) -> Any:
+    """Encode pull options json doesn't know."""
+    if isinstance(o, Checksum):
+        return dict(o.digests, **({"size": o.size} if o.size is not None else {}))
+    if isinstance(o, Timeout):
+        return o.as_dict()
+    if isinstance(o, (Headers, QueryParams)):
+        return o.multi_items()
+    if isinstance(o, Cookies):
+        return list(o.items())
+    raise TypeError(f"{type(o).__name__} can't be journaled")
+
+
+def _decode(options: dict[str, Any]) -> dict[str, Any]:
+    """Rebuild the pull options `_encode` and JSON turned into plain data."""
+    if isinstance(options.get("timeout"), dict):
+        options["timeout"] = Timeout(**options["timeout"])
+    if isinstance(options.get("checksum"), dict):
+        options["checksum"] = Checksum.of(options["checksum"])
+    if isinstance(options.get("auth"), list):
+        options["auth"] = tuple(options["auth"])  # Basic auth
+    for key, cls in ITEMS:
+        if isinstance(options.get(key), list):
+            options[key] = cls([tuple(item) for item in options[key]])
+    return options
+
+
+def _secret(options: Mapping[str, Any]) -> bool:
+    """Whether pull `options` carry credentials."""
+    if options.get("auth") is not None or options.get("extra_cookies"):
+        return True
+    headers = Headers(options.get("extra_headers"))
+    return any(key in SECRET_HEADERS for key in headers.keys())
+
+
+class JournalEntry:
+    """A journaled job."""
+
+    __slots__ = ("id", "url", "path", "options", "status", "error")
+
+    def __init__(self, id: int, url: str, path: str | None,
+                 options: dict[str, Any] | None, status: str, error: str | None):
+        self.id = id
+        self.url = url
+        self.path = path
+        self.options = options
+        """Keyword arguments of `pull`, `None` if they weren't journaled"""
+        self.status = status
+        self.error = error
+
+    def __repr__(self) -> str:
+        return f"JournalEntry({self.id}, {self.url}, {self.status})"
+
+
+class PullerJournal:
+    """
+    # PullerJournal Class
+    A crash-safe log of pull jobs, backed by SQLite in WAL mode.
+
+    Jobs go through `queued`, `running`, then `done`, `failed`
+    or `cancelled`. Changes are buffered and written in one transaction
+    every `flush_interval` seconds or `batch_size` changes,
+    so at most that much progress is lost on a crash.
+    Changes of a job within one batch collapse into one row write.
+
+    Credentials in options, i.e. `auth`, cookies and `Authorization`,
+    `Proxy-Authorization` or `Cookie` headers, are only written to the
+    database, in plaintext, with `keep_secrets`. Otherwise jobs carrying
+    them are journaled without options, like jobs whose options can't be
+    encoded, and can't be recovered.
+
+    Every query runs in one `AsinkRunner` thread that owns the connection.
+    """
+
+    def __init__(self, path: str | os.PathLike = ":memory:",
+                 batch_size: int = 1024, flush_interval: float = 0.5,
+                 keep_secrets: bool = False):
+        """
+        * `path` - path of the SQLite database
+        * `batch_size` - changes buffered before they are written
+        * `flush_interval` - max seconds changes are buffered
+        * `keep_secrets` - journal credentials in plaintext, so jobs
+        carrying them can be recovered
+        """
+        self.path = os.fspath(path)
+        self.batch_size = max(batch_size, 1)
+        self.flush_interval = flush_interval
+        self.keep_secrets = keep_secrets
+        self._sink = AsinkRunner()
+        self._db: sqlite3.Connection | None = None
+        self._next_id: int | None = None
+        self._inserts: dict[int, list] = {}
+        """Rows of new jobs not written yet"""
+        self._updates: dict[int, tuple[str, str | None, float]] = {}
+        """Statuses of written jobs not updated yet"""
+        self._inflight: asyncio.Future | None = None
+        self._timer: asyncio.TimerHandle | None = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._db is None:
+            self._db = sqlite3.connect(self.path)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id INTEGER PRIMARY KEY, url TEXT NOT NULL, path TEXT, "
+                "options TEXT NOT NULL, status TEXT NOT NULL, error TEXT, "
+                "updated REAL NOT NULL)")
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status)")
+        return self._db
+
+    def _last_id(self) -> int:
+        return self._connect().execute(
+            "SELECT coalesce(max(id), 0) FROM jobs").fetchone()[0]
+
+    def _write(self, inserts: list[list],
+               updates: list[tuple[str, str | None, float, int]]) -> None:
+        with self._connect() as db:
+            db.executemany(
+                "INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, ?, ?, ?, ?)",
+                inserts)
+            db.executemany(
+                "UPDATE jobs SET status = ?, error = ?, updated = ? "
+                "WHERE id = ?", updates)
+
+    def _select(self, statuses: tuple[str, ...]) -> list[JournalEntry]:
+        rows = self._connect().execute(
+            "SELECT id, url, path, options, status, error FROM jobs "
+            f"WHERE status IN ({', '.join('?' * len(statuses))}) ORDER BY id",
+            statuses).fetchall()
+        entries = []
+        for id, url, path, options, status, error in rows:
+            options = json.loads(options)
+            entries.append(JournalEntry(
+                id, url, path, options and _decode(options), status, error))
+        return entries
+
+    def _counts(self) -> dict[str, int]:
+        return dict(self._connect().execute(
+            "SELECT status, count(*) FROM jobs GROUP BY status").fetchall())
+
+    def _close(self) -> None:
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    async def open(self) -> PullerJournal:
+        """Open the database, called on first use by pullers."""
+        if self._next_id is None:
+            self._next_id = await self._sink.run(self._last_id) + 1
+        return self
+
+    def add(self, url: str, path: str | os.PathLike | None,
+            options: Mapping[str, Any]) -> int:
+        """
+        Journal a new queued job, returns its id.
+        * `options` - keyword arguments of `pull`, encoded as JSON,
+        or left out if they can't be or hold credentials
+        """
+        if self._next_id is None:
+            raise RuntimeError("Journal is not open")
+        id, self._next_id = self._next_id, self._next_id + 1
+        try:
+            if not self.keep_secrets and _secret(options):
+                raise TypeError("Credentials are not journaled")
+            encoded = json.dumps(options, default=_encode)
+        except (TypeError, ValueError):
+            encoded = "null"  # Not recoverable
+        self._inserts[id] = [
+            id, url, None if path is None else os.fspath(path),
+            encoded, "queued", None, time.time()]
+        self._schedule()
+        return id
+
+    def update(self, id: int, status: str, error: str | None = None) -> None:
+        """Change the status of the job `id`."""
+        row = self._inserts.get(id)
+        if row is not None:
+            row[4:] = [status, error, time.time()]
+        else:
+            self._updates[id] = (status, error, time.time())
+        self._schedule()
+
+    def _schedule(self) -> None:
+        """Flush when the batch is full or the interval passed."""
+        if self._inflight is not None and not self._inflight.done():
+            return  # Flushed again once the write in flight is done
+        if len(self._inserts) + len(self._updates) >= self.batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(
+                self.flush_interval, self._flush)
+
+    def _flush(self) -> asyncio.Future | None:
+        """Write the buffered changes, one write in flight at a time."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._inflight is not None and not self._inflight.done():
+            return self._inflight
+        if not self._inserts and not self._updates:
+            return None
+        inserts = list(self._inserts.values())
+        updates = [(*v, k) for k, v in self._updates.items()]
+        self._inserts, self._updates = {}, {}
+        self._inflight = self._sink.run(self._write, inserts, updates)
+
+        def done(fut: asyncio.Future) -> None:
+            if self._inflight is fut:
+                self._inflight = None
+            if not fut.cancelled() and fut.exception() is None \
+                    and (self._inserts or self._updates):
+                self._schedule()
+
+        self._inflight.add_done_callback(done)
+        return self._inflight
+
+    async def flush(self) -> None:
+        """Write every buffered change now."""
+        while (fut := self._flush()) is not None:
+            await fut
+
+    async def unfinished(self) -> list[JournalEntry]:
+        """Jobs still queued or running, e.g. when the last run crashed."""
+        await self.flush()
+        return await self._sink.run(self._select, UNFINISHED)
+
+    async def counts(self) -> dict[str, int]:
+        """Number of jobs by status."""
+        await self.flush()
+        return await self._sink.run(self._counts)
+
+    async def aclose(self) -> None:
+        """Write buffered changes and close the database."""
+        if not self._sink.closed:
+            await self.flush()
+            await self._sink.run(self._close)
+            await self._sink.aclose()
+
+    def __repr__(self) -> str:
+        return f"PullerJournal({self.path})"
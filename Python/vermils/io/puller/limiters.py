@@ -0,0 +1,314 @@
+"""Rate and Concurrency Limits for Pullers"""
+from __future__ import annotations
+import time
+import asyncio
+from contextlib import contextmanager
+from typing import Any, Hashable, Iterator
+import httpx
+
+__all__ = ("TokenBucket", "HostLimit", "AIMDController", "BandwidthLimiter")
+
+
+class TokenBucket:
+    """
+    # TokenBucket Class
+    Allows `rate` acquisitions per second on average,
+    with bursts of up to `burst` acquisitions.
+
+    Never blocks, callers are told how long to come back after instead.
+    """
+
+    __slots__ = ("rate", "burst", "_tokens", "_last")
+
+    def __init__(self, rate: float, burst: float = 1):
+        """
+        * `rate` - tokens added per second
+        * `burst` - max tokens the bucket holds
+        """
+        if rate <= 0 or burst <= 0:
+            raise ValueError("rate and burst must be positive")
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._last = time.monotonic()
+
+    @property
+    def tokens(self) -> float:
+        """Tokens currently in the bucket."""
+        now = time.monotonic()
+        self._tokens = min(self.burst,
+                           self._tokens + (now - self._last) * self.rate)
+        self._last = now
+        return self._tokens
+
+    def delay(self, n: float = 1) -> float:
+        """Seconds until `n` tokens are available."""
+        return max(n - self.tokens, 0) / self.rate
+
+    def acquire(self, n: float = 1) -> float:
+        """
+        Take `n` tokens if available.
+        Returns `0` on success, otherwise seconds until they will be.
+        """
+        tokens = self.tokens
+        if tokens >= n:
+            self._tokens = tokens - n
+            return 0
+        return (n - tokens) / self.rate
+
+    def __repr__(self) -> str:
+        return f"TokenBucket(rate={self.rate}, burst={self.burst})"
+
+
+class _Pacer:
+    """
+    Splits `rate` bytes per second evenly between its active flows,
+    each paced on its own, whatever the size of their reservations.
+    """
+
+    __slots__ = ("rate", "burst", "_tats")
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self._tats: dict[Hashable, float] = {}
+        """Time the bytes reserved so far are paid off at by flow"""
+
+    def reserve(self, flow: Hashable, n: int, now: float) -> float:
+        """Reserve `n` bytes of `flow`, returns seconds to wait before using them."""
+        tat = max(self._tats.setdefault(flow, now), now)
+        share = self.rate / len(self._tats)
+        tat = self._tats[flow] = tat + n / share
+        return tat - now - self.burst / self.rate
+
+    def join(self, flow: Hashable, now: float) -> None:
+        """Start sharing with `flow`."""
+        self._tats.setdefault(flow, now)
+
+    def leave(self, flow: Hashable) -> bool:
+        """Stop sharing with `flow`, returns whether any flow is left."""
+        self._tats.pop(flow, None)
+        return bool(self._tats)
+
+
+class BandwidthLimiter:
+    """
+    # BandwidthLimiter Class
+    Caps the bytes per second a puller receives, overall and by host.
+
+    Workers reserve each chunk after reading it and sleep until it's paid
+    off, which holds back their next read. Each active worker is paced
+    on its own at an even share of the rate, so workers reading large
+    chunks don't crowd out the others. A reservation costs a few float
+    operations and no lock.
+
+    Limits can be changed at runtime, `None` lifts them.
+    """
+
+    def __init__(self, rate: float | None = None,
+                 per_host: float | None = None, burst: int = 2**20):
+        """
+        * `rate` - max bytes per second of the puller
+        * `per_host` - max bytes per second of each host (or `limit_key`)
+        * `burst` - bytes received at once before pacing starts
+        """
+        self._global: _Pacer | None = None
+        self._hosts: dict[str, _Pacer] = {}
+        self._per_host: float | None = None
+        self._flows: dict[Hashable, int] = {}
+        """Transfers in progress by flow"""
+        self.burst = max(burst, 0)
+        self.rate = rate
+        self.per_host = per_host
+
+    @property
+    def rate(self) -> float | None:
+        return self._global.rate if self._global is not None else None
+
+    @rate.setter
+    def rate(self, value: float | None) -> None:
+        if value is not None and value <= 0:
+            raise ValueError("rate must be positive")
+        if value is None:
+            self._global = None
+        elif self._global is None:
+            self._global = _Pacer(value, self.burst)
+        else:
+            self._global.rate = value
+
+    @property
+    def per_host(self) -> float | None:
+        return self._per_host
+
+    @per_host.setter
+    def per_host(self, value: float | None) -> None:
+        if value is not None and value <= 0:
+            raise ValueError("per_host must be positive")
+        self._per_host = value
+        if value is None:
+            self._hosts.clear()
+        for pacer in self._hosts.values():
+            pacer.rate = value  # type: ignore[assignment]
+
+    @contextmanager
+    def flow(self, key: str, flow: Hashable) -> Iterator[None]:
+        """
+        Count `flow` (e.g. a worker) as active on `key` until the block
+        exits, so its share goes to the others once all its transfers end.
+        """
+        self._flows[flow] = self._flows.get(flow, 0) + 1
+        if self._flows[flow] == 1:
+            now = time.monotonic()
+            if self._global is not None:
+                self._global.join(flow, now)
+            if self._per_host is not None:
+                self._host(key).join(flow, now)
+        try:
+            yield
+        finally:
+            self._flows[flow] -= 1
+            if not self._flows[flow]:
+                del self._flows[flow]
+                if self._global is not None:
+                    self._global.leave(flow)
+                pacer = self._hosts.get(key)
+                if pacer is not None and not pacer.leave(flow):
+                    del self._hosts[key]
+
+    def reserve(self, key: str, n: int, flow: Hashable = None) -> float:
+        """Reserve `n` bytes of `flow` on `key`, returns seconds to wait."""
+        now = time.monotonic()
+        wait = 0.0
+        if self._global is not None:
+            wait = self._global.reserve(flow, n, now)
+        if self._per_host is not None:
+            wait = max(wait, self._host(key).reserve(flow, n, now))
+        return wait
+
+    def _host(self, key: str) -> _Pacer:
+        pacer = self._hosts.get(key)
+        if pacer is None:
+            pacer = self._hosts[key] = _Pacer(
+                self._per_host, self.burst)  # type: ignore[arg-type]
+        return pacer
+
+    async def throttle(self, key: str, n: int, flow: Hashable = None) -> None:
+        """Reserve `n` bytes of `flow` on `key` and wait until they are paid off."""
+        wait = self.reserve(key, n, flow)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def __repr__(self) -> str:
+        return f"BandwidthLimiter(rate={self.rate}, per_host={self.per_host})"
+
+
+class HostLimit:
+    """Concurrency cap and request rate of one host (or key)."""
+
+    __slots__ = ("max_workers", "rate", "burst")
+
+    def __init__(self, max_workers: int | None = None,
+                 rate: float | None = None, burst: float = 1):
+        """
+        * `max_workers` - max running workers, `None` for no limit
+        * `rate` - max workers spawned per second, `None` for no limit
+        * `burst` - max workers spawned at once under `rate`
+        """
+        self.max_workers = max_workers
+        self.rate = rate
+        self.burst = burst
+
+    def __repr__(self) -> str:
+        return f"HostLimit(max_workers={self.max_workers}, " +\
+            f"rate={self.rate}, burst={self.burst})"
+
+
+class AIMDController:
+    """
+    # AIMDController Class
+    Resizes `max_workers` of a puller at runtime with additive increase,
+    multiplicative decrease.
+
+    Once per `interval`, the limit shrinks by `decrease` if a request
+    timed out or was answered with `429`/`503`, or grows by `increase`
+    if the workers are saturated and throughput keeps rising.
+    Changes are emitted as `puller.concurrency` events.
+    """
+
+    congestion_status = frozenset((429, 503))
+    """Status codes telling the remote is overloaded"""
+
+    def __init__(self, min_workers: int = 1, max_workers: int = 64,
+                 increase: int = 1, decrease: float = 0.5,
+                 interval: float = 1.0, tolerance: float = 0.05):
+        """
+        * `min_workers`, `max_workers` - bounds of the limit
+        * `increase` - workers added when throughput keeps rising
+        * `decrease` - factor the limit is multiplied by on congestion
+        * `interval` - min seconds between two decisions
+        * `tolerance` - relative throughput gain counted as rising
+        """
+        if not 0 < decrease < 1:
+            raise ValueError("decrease must be in (0, 1)")
+        self.min_workers = max(min_workers, 1)
+        self.max_workers = max(max_workers, self.min_workers)
+        self.increase = increase
+        self.decrease = decrease
+        self.interval = interval
+        self.tolerance = tolerance
+        self.rate = 0.0
+        """Throughput in bytes per second over the last interval"""
+        self._congested = False
+        self._last = time.monotonic()
+        self._downloaded = 0
+
+    def attach(self, puller: Any) -> None:
+        """Watch the events of `puller` and resize its limit."""
+        puller.max_workers = min(max(puller.max_workers, self.min_workers),
+                                 self.max_workers)
+
+        @puller.on.worker.response_get
+        async def on_response(event, worker, r: httpx.Response):
+            if r.status_code in self.congestion_status:
+                self._congested = True
+            await self.update(puller)
+
+        @puller.on.worker.retry
+        async def on_retry(event, worker, e: Exception, retry: int):
+            if isinstance(e, httpx.TimeoutException) or \
+                    isinstance(e, httpx.HTTPStatusError) and \
+                    e.response.status_code in self.congestion_status:
+                self._congested = True
+            await self.update(puller)
+
+        @puller.on.worker.progress
+        @puller.on.worker.destroy
+        async def on_activity(event, worker, *args):
+            await self.update(puller)
+
+    async def update(self, puller: Any) -> None:
+        """Make a decision if `interval` passed since the last one."""
+        now = time.monotonic()
+        if now - self._last < self.interval:
+            return
+        rate = (puller.downloaded - self._downloaded) / (now - self._last)
+        self._last, self._downloaded = now, puller.downloaded
+        limit = puller.max_workers
+        if self._congested:
+            self._congested = False
+            new, reason = max(int(limit * self.decrease), self.min_workers), \
+                "decrease"
+        elif puller.running >= limit and rate > self.rate * (1 + self.tolerance):
+            new, reason = min(limit + self.increase, self.max_workers), \
+                "increase"
+        else:
+            new, reason = limit, "hold"
+        self.rate = rate
+        if new != limit:
+            puller.max_workers = new
+            await puller.event_hooks.aemit(
+                "puller.concurrency", puller, new, reason)
+
+    def __repr__(self) -> str:
+        return f"AIMDController(min_workers={self.min_workers}, " +\
+            f"max_workers={self.max_workers})"
@@ -0,0 +1,246 @@
+"""Metrics of Pullers"""
+from __future__ import annotations
+import time
+import math
+import bisect
+from typing import Any, Sequence
+import httpx
+
+__all__ = ("Histogram", "HostMetrics", "PullerMetrics")
+
+
+class Histogram:
+    """Counts of observed values by upper bound, like Prometheus ones."""
+
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: Sequence[float]):
+        self.bounds = tuple(sorted(bounds))
+        self.counts = [0] * (len(self.bounds) + 1)
+        """Counts of each bucket, the last one is `+Inf`"""
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> list[tuple[float, int]]:
+        """`(upper bound, count of values <= it)` of each bucket."""
+        total = 0
+        buckets = []
+        for bound, n in zip(self.bounds + (math.inf,), self.counts):
+            total += n
+            buckets.append((bound, total))
+        return buckets
+
+    def snapshot(self) -> dict[str, Any]:
+        return {"count": self.count, "sum": self.sum,
+                "buckets": self.cumulative()}
+
+    def __repr__(self) -> str:
+        return f"Histogram(count={self.count}, sum={self.sum})"
+
+
+class HostMetrics:
+    """Metrics of the jobs of one host (or limit key)."""
+
+    ttfb_bounds = (.01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+    duration_bounds = (.05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+    def __init__(self):
+        self.active = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.bytes = 0
+        """Bytes received by finished attempts"""
+        self.retries: dict[str, int] = {}
+        """Retries by reason, status codes or exception names"""
+        self.failures: dict[str, int] = {}
+        """Failures by reason, status codes or exception names"""
+        self.ttfb = Histogram(self.ttfb_bounds)
+        """Seconds from the start of workers to their first response"""
+        self.duration = Histogram(self.duration_bounds)
+        """Seconds from the start of successful workers to their end"""
+
+    def snapshot(self) -> dict[str, Any]:
+        return {
+            "active": self.active,
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "bytes": self.bytes,
+            "retries": dict(self.retries),
+            "failures": dict(self.failures),
+            "ttfb": self.ttfb.snapshot(),
+            "duration": self.duration.snapshot(),
+        }
+
+
+def _reason(e: BaseException) -> str:
+    if isinstance(e, httpx.HTTPStatusError):
+        return str(e.response.status_code)
+    return type(e).__name__
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class PullerMetrics:
+    """
+    # PullerMetrics Class
+    Counters, gauges and histograms of a puller, overall and by host.
+
+    Fed by the worker lifecycle events only, never per chunk,
+    so `snapshot` and `render` are cheap enough to poll.
+    """
+
+    def __init__(self):
+        self.total = HostMetrics()
+        self.hosts: dict[str, HostMetrics] = {}
+        """Metrics by host (or `limit_key`)"""
+        self._puller: Any = None
+        self._started: dict[int, tuple[float, bool]] = {}
+        """Start time and whether it failed of running workers by id"""
+        self._sampled = (time.monotonic(), 0)
+
+    def host(self, key: str) -> HostMetrics:
+        if key not in self.hosts:
+            self.hosts[key] = HostMetrics()
+        return self.hosts[key]
+
+    def attach(self, puller: Any) -> None:
+        """Watch the events of `puller`."""
+        self._puller = puller
+
+        def both(key: str) -> tuple[HostMetrics, HostMetrics]:
+            return self.total, self.host(key)
+
+        @puller.on.worker.start
+        async def on_start(event, worker):
+            self._started[id(worker)] = (time.monotonic(), False)
+            for m in both(worker.key):
+                m.active += 1
+
+        @puller.on.worker.response_get
+        async def on_response(event, worker, r):
+            started = self._started.get(id(worker))
+            if started is None or worker.key is None:
+                return
+            if not getattr(worker, "_metered_ttfb", False):
+                worker._metered_ttfb = True
+                for m in both(worker.key):
+                    m.ttfb.observe(time.monotonic() - started[0])
+
+        @puller.on.worker.retry
+        async def on_retry(event, worker, e, retry):
+            reason = _reason(e)
+            for m in both(worker.key):
+                m.retries[reason] = m.retries.get(reason, 0) + 1
+                m.bytes += worker.downloaded
+
+        @puller.on.worker.fail
+        async def on_fail(event, worker, e):
+            if id(worker) in self._started:
+                self._started[id(worker)] = (self._started[id(worker)][0], True)
+            reason = _reason(e)
+            for m in both(worker.key):
+                m.failures[reason] = m.failures.get(reason, 0) + 1
+
+        @puller.on.worker.destroy
+        async def on_destroy(event, worker):
+            started = self._started.pop(id(worker), None)
+            if started is None:
+                return
+            since, failed = started
+            for m in both(worker.key):
+                m.active -= 1
+                m.bytes += worker.downloaded
+                if failed:
+                    m.failed += 1
+                else:
+                    m.succeeded += 1
+                    m.duration.observe(time.monotonic() - since)
+
+    def bytes_per_second(self) -> float:
+        """Throughput since the last call."""
+        if self._puller is None:
+            return 0.0
+        now, downloaded = time.monotonic(), self._puller.downloaded
+        since, before = self._sampled
+        self._sampled = (now, downloaded)
+        return (downloaded - before) / max(now - since, 1e-9)
+
+    def snapshot(self) -> dict[str, Any]:
+        """
+        Current values as a dict, throughput is measured since
+        the last snapshot or rendering.
+        """
+        puller = self._puller
+        return {
+            "time": time.time(),
+            "queue_depth": puller.pending if puller else 0,
+            "active_workers": puller.running if puller else 0,
+            "bytes_total": puller.downloaded if puller else 0,
+            "bytes_per_second": self.bytes_per_second(),
+            **self.total.snapshot(),
+            "hosts": {k: m.snapshot() for k, m in self.hosts.items()},
+        }
+
+    def render(self, prefix: str = "puller") -> str:
+        """Current values in the Prometheus text exposition format."""
+        snap = self.snapshot()
+        lines: list[str] = []
+
+        def metric(name: str, kind: str, doc: str, samples) -> None:
+            lines.append(f"# HELP {prefix}_{name} {doc}")
+            lines.append(f"# TYPE {prefix}_{name} {kind}")
+            for suffix, labels, value in samples:
+                label = ",".join(f'{k}="{_escape(str(v))}"'
+                                 for k, v in labels.items())
+                label = f"{{{label}}}" if label else ""
+                lines.append(f"{prefix}_{name}{suffix}{label} {value}")
+
+        hosts = self.hosts.items()
+        metric("queue_depth", "gauge", "Jobs waiting for a worker.",
+               [("", {}, snap["queue_depth"])])
+        metric("active_workers", "gauge", "Workers running.",
+               [("", {}, snap["active_workers"])])
+        metric("bytes_per_second", "gauge", "Bytes received per second.",
+               [("", {}, snap["bytes_per_second"])])
+        metric("bytes_total", "counter", "Bytes received.",
+               [("", {}, snap["bytes_total"])])
+        metric("host_active_workers", "gauge", "Workers running by host.",
+               [("", {"host": k}, m.active) for k, m in hosts])
+        metric("host_bytes_total", "counter",
+               "Bytes received by finished attempts by host.",
+               [("", {"host": k}, m.bytes) for k, m in hosts])
+        metric("jobs_total", "counter", "Finished jobs by host and outcome.",
+               [("", {"host": k, "outcome": o}, n) for k, m in hosts
+                for o, n in (("success", m.succeeded), ("failure", m.failed))])
+        metric("retries_total", "counter", "Retries by host and reason.",
+               [("", {"host": k, "reason": r}, n) for k, m in hosts
+                for r, n in sorted(m.retries.items())])
+        metric("failures_total", "counter", "Failures by host and reason.",
+               [("", {"host": k, "reason": r}, n) for k, m in hosts
+                for r, n in sorted(m.failures.items())])
+        for name, doc in (("ttfb", "Seconds to the first response."),
+                          ("duration", "Seconds successful jobs took.")):
+            samples: list[tuple[str, dict[str, str], float]] = []
+            for k, m in hosts:
+                h: Histogram = getattr(m, name)
+                samples += [("_bucket", {"host": k, "le": _le(b)}, n)
+                            for b, n in h.cumulative()]
+                samples += [("_sum", {"host": k}, h.sum),
+                            ("_count", {"host": k}, h.count)]
+            metric(f"{name}_seconds", "histogram", doc, samples)
+        return "\n".join(lines) + "\n"
+
+    def __repr__(self) -> str:
+        return f"PullerMetrics(succeeded={self.total.succeeded}, " +\
+            f"failed={self.total.failed})"
+
+
+def _le(bound: float) -> str:
+    return "+Inf" if bound == math.inf else repr(float(bound))
@@ -1,6 +1,9 @@
 import rich.progress
+import time
+import heapq
 import asyncio
-from typing import Callable
+from itertools import zip_longest
+from typing import Callable, Literal
 from .pullers import BasePuller, AsyncPuller, AsyncWorker, Response
 from ...gadgets import to_ordinal
 from ...asynctools import ensure_async
@@ -17,6 +20,10 @@ class Modifier:
         desc_len: int = 24,
         delay_on_finish: float | None = 0.5,
         progress: rich.progress.Progress | None = None,
+        aggregate: bool = False,
+        top: int = 5,
+        top_by: Literal["slowest", "largest"] = "slowest",
+        sample_interval: float = 0.25,
     ) -> None:
         """
         ### Show progress of all tasks.
@@ -24,21 +31,27 @@ class Modifier:
         * `desc_len`: max length of url description
         * `delay_on_finish`: time to remove finished progress bar, set to `None` to keep it
         * `progress`: rich.progress.Progress instance, set to `None` to use default one
+        * `aggregate`: show one bar of files and one of bytes, plus the `top`
+        transfers only, refreshed every `sample_interval` seconds,
+        so the cost doesn't grow with the number of files in flight
+        * `top`: active transfers shown in aggregate mode
+        * `top_by`: show the `"slowest"` or the `"largest"` ones
+        * `sample_interval`: seconds between two refreshes in aggregate mode
         """
         from rich.progress import Progress
         if cls.progress is None:
             cls.progress = Progress(refresh_per_second=30)
         _progress = progress or cls.progress
 
-        if isinstance(puller, AsyncPuller):
+        if isinstance(puller, AsyncPuller) and aggregate:
+            cls._show_aggregate_progress(
+                puller, _progress, desc_len, top, top_by, sample_interval)
+        elif isinstance(puller, AsyncPuller):
             @puller.on.worker.start
             async def create_task(event: str, worker: AsyncWorker):
                 nonlocal puller
                 progress = _progress  # In case outer progress is changed
-                desc = worker.url.split("://")[-1]
-                if len(desc) > desc_len:
-                    desc = desc[:(desc_len-3)//2] + "..." + \
-                        desc[-(desc_len-3)//2:]
+                desc = cls._describe(worker.url, desc_len)
                 progress.start()  # start progress bar
                 task = progress.add_task(desc)
                 total = 0
@@ -51,12 +64,13 @@ class Modifier:
                     total = int(r.headers.get("Content-Length", 0))
                     progress.update(task, total=total or 100)
 
-                @worker.event_hooks.on.worker.bytes_get
-                async def update_task(ev: str, w: AsyncWorker, r: Response, b: bytes):
-                    nonlocal task
+                @worker.event_hooks.on.worker.progress
+                async def update_task(ev: str, w: AsyncWorker,
+                                      downloaded: int, size: int | None):
                     nonlocal total
-                    if total:
-                        progress.update(task, completed=r.num_bytes_downloaded)
+                    if size:
+                        total = size
+                        progress.update(task, total=total, completed=downloaded)
 
                 @worker.event_hooks.on.worker.fail
                 async def fail_task(ev: str, w: AsyncWorker, e: Exception):
@@ -81,6 +95,102 @@ class Modifier:
                     if progress.finished:
                         progress.stop()
 
+    @staticmethod
+    def _describe(url: str, desc_len: int) -> str:
+        """Shorten `url` to `desc_len` characters."""
+        desc = url.split("://")[-1]
+        if len(desc) > desc_len:
+            desc = desc[:(desc_len-3)//2] + "..." + desc[-(desc_len-3)//2:]
+        return desc
+
+    @classmethod
+    def _show_aggregate_progress(
+        cls,
+        puller: AsyncPuller,
+        progress: rich.progress.Progress,
+        desc_len: int,
+        top: int,
+        top_by: Literal["slowest", "largest"],
+        interval: float,
+    ) -> None:
+        """Aggregate mode of `show_progress`."""
+        if top_by not in ("slowest", "largest"):
+            raise ValueError(f"Unknown top_by: {top_by}")
+        active: dict[int, tuple[AsyncWorker, float]] = {}
+        """Running workers and their start time by id"""
+        failed: set[int] = set()
+        done = errors = 0
+        done_bytes = 0
+        files = progress.add_task("Files", total=None, visible=False)
+        size = progress.add_task("Bytes", total=None, visible=False)
+        slots = [progress.add_task("", total=None, visible=False)
+                 for _ in range(max(top, 0))]
+        sampler: asyncio.Task | None = None
+
+        def rank(item: tuple[AsyncWorker, float]) -> float:
+            worker, since = item
+            if top_by == "largest":
+                return -(worker.total or worker.downloaded)
+            return worker.downloaded / max(time.monotonic() - since, 1e-3)
+
+        def render() -> None:
+            progress.start()
+            finished = done + errors
+            progress.update(
+                files, completed=finished, visible=True,
+                total=finished + len(active) + puller.pending,
+                description=f"Files ({errors} failed)" if errors else "Files")
+            running = sum(w.downloaded for w, _ in active.values())
+            expected = sum(w.total or w.downloaded for w, _ in active.values())
+            progress.update(size, completed=done_bytes + running,
+                            total=done_bytes + expected or None, visible=True)
+            shown = heapq.nsmallest(len(slots), active.values(), key=rank)
+            for task, item in zip_longest(slots, shown):
+                if item is None:
+                    progress.update(task, visible=False)
+                else:
+                    worker = item[0]
+                    progress.update(
+                        task, description=cls._describe(worker.url, desc_len),
+                        total=worker.total, completed=worker.downloaded,
+                        visible=True)
+
+        async def sample():
+            nonlocal sampler
+            try:
+                while active or puller.pending:
+                    render()
+                    await asyncio.sleep(interval)
+            finally:
+                sampler = None
+                render()
+                progress.refresh()
+                progress.stop()
+
+        @puller.on.worker.start
+        async def add_worker(event: str, worker: AsyncWorker):
+            nonlocal sampler
+            active[id(worker)] = (worker, time.monotonic())
+            if sampler is None:
+                sampler = asyncio.create_task(sample())
+
+        @puller.on.worker.fail
+        async def fail_worker(event: str, worker: AsyncWorker, e: Exception):
+            if not isinstance(e, FileExistsError):  # Skipped, not failed
+                failed.add(id(worker))
+
+        @puller.on.worker.destroy
+        async def remove_worker(event: str, worker: AsyncWorker):
+            nonlocal done, errors, done_bytes
+            if active.pop(id(worker), None) is None:
+                return
+            if id(worker) in failed:
+                failed.discard(id(worker))
+                errors += 1
+            else:
+                done += 1
+                done_bytes += worker.downloaded
+
     @staticmethod
     def ignore_failure(puller: BasePuller) -> None:
         """
@@ -179,6 +289,7 @@ class Modifier:
             @puller.on.worker.start
             @puller.on.worker.response_get
             @puller.on.worker.bytes_get
+            @puller.on.worker.progress
             @puller.on.worker.retry
             @puller.on.worker.destroy
             @puller.on.worker.fail
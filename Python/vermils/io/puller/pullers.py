@@ -2,15 +2,32 @@
 # -*- coding: utf-8 -*-
 from __future__ import annotations
 import os
+import json
+import time
+import math
+import heapq
 import asyncio
+import multiprocessing
 from asyncio import Future
+from concurrent.futures import Executor, ProcessPoolExecutor
+from contextlib import suppress, nullcontext, asynccontextmanager, AsyncExitStack
 from typing import Iterable, Mapping, Any, Callable, Awaitable, Sequence, TypeVar
+from typing import AsyncIterable, AsyncGenerator, AsyncIterator, Literal
 from abc import abstractmethod
 from httpx import Request, Response, Timeout
 from ..misc import DummyAioFileStream as Dummyf
-from ...io import aio
+from ...asynctools import async_run
 from ...collections import StrChain
 from ...react import ActionChain, EventHook, EventHint as Hint
+from .cache import CacheEntry, PullerCache
+from .journal import PullerJournal
+from .limiters import HostLimit, TokenBucket, AIMDController, BandwidthLimiter
+from .metrics import PullerMetrics
+from .checksums import Checksum, ChecksumMismatch, HashFeed
+from .retry import RetryPolicy, CircuitOpen
+from .sinks import MemorySink, CallbackSink, TarSink, Consumer
+from .store import BlobStore, link_file
+from .writers import WriterPool, PositionalFile
 from httpx._types import HeaderTypes, ProxiesTypes, CookieTypes, QueryParamTypes
 import httpx
 
@@ -50,6 +67,7 @@ class BaseMaster:
 
 
 HttpActionType = Callable[[Request | Response], Awaitable]
+PullJob = str | tuple | Mapping[str, Any]
 ActionVar = TypeVar('ActionVar', bound=Callable)
 
 
@@ -70,17 +88,168 @@ class AsyncPullerEventHook(EventHook):
         self.hook("worker.destroy", ActionChain())
         self.hook("worker.start", ActionChain())
         self.hook("worker.response_get", ActionChain())
+        self.hook("worker.cache_hit", ActionChain())
         self.hook("worker.bytes_get", ActionChain())
+        self.hook("worker.progress", ActionChain())
         self.hook("worker.retry", ActionChain())
         self.hook("worker.success", ActionChain())
         self.hook("worker.fail", ActionChain())
         self.hook("puller.spawn", ActionChain())
         self.hook("puller.destroy", ActionChain())
         self.hook("puller.join", ActionChain())
+        self.hook("puller.concurrency", ActionChain())
         EventHook.__init__(self, chain=chain)
 
 
+class _PartState:
+    """
+    Progress of a resumable pull, kept in a sidecar next to the `.part` file.
+
+    `pieces` are the `[validated offset, end)` byte ranges of the body,
+    `end` is `None` if the size is unknown.
+    """
+
+    def __init__(self, path: str, url: str):
+        self.path = os.fspath(path)
+        self.part = f"{self.path}.part"
+        self.sidecar = f"{self.part}.json"
+        self.url = url
+        self.etag: str | None = None
+        self.last_modified: str | None = None
+        self.pieces: list[list] = []
+        self._lock = asyncio.Lock()
+
+    @property
+    def validator(self) -> str | None:
+        """Validator for `If-Range`, weak ETags are not allowed."""
+        if self.etag and not self.etag.startswith("W/"):
+            return self.etag
+        return self.last_modified
+
+    def matches(self, r: Response) -> bool:
+        """Whether `r` describes the same body as the `.part` file."""
+        if self.etag and not self.etag.startswith("W/"):
+            return self.etag == r.headers.get("ETag")
+        return self.last_modified is not None \
+            and self.last_modified == r.headers.get("Last-Modified")
+
+    def reset(self, r: Response, pieces: list[list]) -> None:
+        """Start over for the body described by `r`."""
+        self.etag = r.headers.get("ETag")
+        self.last_modified = r.headers.get("Last-Modified")
+        self.pieces = pieces if self.validator else []
+
+    def load(self) -> None:
+        """Load the state left by an earlier attempt or process."""
+        try:
+            with open(self.sidecar, encoding="utf-8") as f:
+                data = json.load(f)
+            size = os.path.getsize(self.part)
+        except (OSError, ValueError):
+            return
+        if data.get("url") != self.url:
+            return
+        self.etag = data.get("etag")
+        self.last_modified = data.get("last_modified")
+        self.pieces = [[min(start, size), end]
+                       for start, end in data.get("pieces", [])]
+
+    def save(self) -> None:
+        """Write the state to the sidecar atomically."""
+        tmp = f"{self.sidecar}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({
+                "url": self.url,
+                "etag": self.etag,
+                "last_modified": self.last_modified,
+                "pieces": self.pieces,
+            }, f)
+        os.replace(tmp, self.sidecar)
+
+    async def asave(self) -> None:
+        async with self._lock:
+            if self.pieces:
+                await async_run(self.save)
+
+    def commit(self) -> None:
+        """Move the completed `.part` file to its final path."""
+        os.replace(self.part, self.path)
+        with suppress(FileNotFoundError):
+            os.remove(self.sidecar)
+        self.pieces = []
+
+    def discard(self) -> None:
+        """Remove the `.part` file and its sidecar."""
+        for p in (self.part, self.sidecar):
+            with suppress(FileNotFoundError):
+                os.remove(p)
+        self.pieces = []
+
+
+class _Racer:
+    """One transfer of a hedged pull, into a target of its own."""
+
+    __slots__ = ("url", "target", "memory", "feed", "downloaded", "total",
+                 "started", "response")
+
+    def __init__(self, url: str, target: str):
+        self.url = url
+        self.target = target
+        self.memory: MemorySink | None = None
+        self.feed: HashFeed | None = None
+        self.downloaded = 0
+        """Bytes received over the wire, counted as chunks are handed out"""
+        self.total: int | None = None
+        self.started = time.monotonic()
+        self.response: Response | None = None
+
+    @property
+    def received(self) -> int:
+        """Bytes received over the wire as they arrive, `0` before the first"""
+        r = self.response
+        return r.num_bytes_downloaded if r is not None else 0
+
+    def rate(self) -> float:
+        return self.received / max(time.monotonic() - self.started, 1e-3)
+
+
+class _Watcher:
+    """Futures an iterator of the puller waits for, each with a tag."""
+
+    __slots__ = ("futures", "finished", "every")
+
+    def __init__(self, every: bool):
+        self.futures: dict[int, tuple[Future, Any]] = {}
+        self.finished: asyncio.Queue[Future | None] = asyncio.Queue()
+        self.every = every
+        """Whether jobs pulled meanwhile are watched too"""
+
+    def watch(self, future: Future, tag: Any = None) -> None:
+        self.futures[id(future)] = (future, tag)
+        future.add_done_callback(self.finished.put_nowait)
+
+    def unwatch(self, future: Future) -> None:
+        if self.futures.pop(id(future), None) is not None:
+            future.remove_done_callback(self.finished.put_nowait)
+            self.finished.put_nowait(None)  # Wake to notice
+
+    async def get(self) -> tuple[Future, Any] | None:
+        """Wait for the next finished future, `None` if woken otherwise."""
+        done = await self.finished.get()
+        return self.futures.pop(id(done), None) if done is not None else None
+
+    def close(self) -> None:
+        for future, _ in self.futures.values():
+            future.remove_done_callback(self.finished.put_nowait)
+        self.futures.clear()
+
+
 class AsyncWorker(BaseWorker):
+    checkpoint_size = 2**23
+    """Bytes pulled between two sidecar updates in resume mode"""
+    chunk_period = 0.05
+    """Seconds of the observed throughput each chunk aims to hold"""
+
     def __init__(
         self,
         puller: AsyncPuller,
@@ -94,6 +263,19 @@ class AsyncWorker(BaseWorker):
         extra_headers: HeaderTypes | None,
         extra_params: QueryParamTypes | None,
         extra_cookies: CookieTypes | None,
+        limit_key: str | None = None,
+        priority: int = 0,
+        deadline: float | None = None,
+        segments: int = 1,
+        resume: bool = False,
+        digest: str | None = None,
+        checksum: Checksum | Mapping[str, Any] | None = None,
+        job_id: int | None = None,
+        sink: Literal["memory"] | Consumer | TarSink | None = None,
+        postprocess: Callable[[Any], Any] | None = None,
+        mirrors: Sequence[str] = (),
+        hedge_delay: float | None = None,
+        hedge_rate: float | None = None,
         **kw
     ):
         self.puller = puller
@@ -106,89 +288,931 @@ class AsyncWorker(BaseWorker):
         self.extra_headers = extra_headers
         self.extra_params = extra_params
         self.extra_cookies = extra_cookies
+        self.key = limit_key or httpx.URL(url).host
+        """Key of the limits this worker obeys"""
+        self.priority = priority
+        self.deadline = deadline
+        """`time.monotonic()` time the worker should start by"""
+        self.segments = max(segments, 1)
+        self.mirrors = tuple(mirrors)
+        """Other urls of the same body, raced by hedged requests"""
+        self.hedge_delay = hedge_delay
+        self.hedge_rate = hedge_rate
+        self.method: str = kw.pop("method", "GET")
         self.kw = kw
+        self.downloaded = 0
+        """Bytes received over the wire in the current attempt"""
+        self.total: int | None = None
+        """Bytes to receive in the current attempt, if known"""
+        self._reported = 0
+        """`downloaded` at the last `worker.progress` event"""
+        self._reported_at = 0.0
+        self.digest = digest
+        """Digest of the body in the store, known or learned after pulling"""
+        self._state = _PartState(path, url) if resume and path else None
+        self._target: str | os.PathLike = \
+            self._state.part if self._state else self.path or ""
+        """Where the body is written before it's complete"""
+        if puller.store is not None and path and self._state is None:
+            self._target = puller.store.temp()
+        self.checksum = Checksum.of(checksum) if checksum else None
+        """Expected size and digests of the body"""
+        self.job_id = job_id
+        """Id of the job in the journal of the puller"""
+        self.sink = sink
+        """`"memory"`, an async consumer of chunks or a `TarSink`, instead of a path"""
+        self._memory: MemorySink | None = None
+        self.postprocess = postprocess
+        """Run in the process pool of the puller on the pulled path or body"""
+        self._feed: HashFeed | None = None
+        """Hashes the body as it streams in, if written from the start"""
+        self._leading: _Racer | None = None
+        """Racer of a hedged pull counted in the progress"""
+        self._flight: tuple | None = None
+        """Key of the identical pulls this worker serves, if coalesced"""
+        self._followers: list[AsyncWorker] = []
+        """Workers of the pulls it serves, which never run themselves"""
+        self._cache_key = ""
+        self._conditions: dict[str, str] = {}
+        """Headers to revalidate the cached file"""
         self.event_hooks = AsyncPullerEventHook(
             self.puller.event_hooks)  # snapshot
 
     async def run(self):
         """Run the worker."""
         event_hooks = self.event_hooks
+        staged = False
+        self._journal("running")
         try:
             await event_hooks.aemit("worker.start", self)
-            if self.path and os.path.exists(self.path) and not self.overwrite:
+            entry = await self._cached()
+            if entry is None and self.path and os.path.exists(self.path) \
+                    and not self.overwrite:
                 raise FileExistsError(f"{self.path} already exists")
-            client = self.puller.client
+            stored = entry is None and await self._linked()
+            if self._state is not None and not stored:
+                await async_run(self._state.load)
+            policy = self.puller.retry_policy
+            breaker = policy.breaker
             retry = 0
+            wait = 0.0
             while True:
                 try:
-                    # Open file in async mode, if path is None, write to void
-                    async with aio.open(self.path, "wb") \
-                            if self.path else Dummyf() as f:  # type: ignore
-                        # Establish connection
-                        async with client.stream(
-                            method=self.kw.pop("method", "GET"),
-                            url=self.url,
-                            params=self.extra_params,
-                            headers=self.extra_headers,
-                            cookies=self.extra_cookies,
-                            timeout=self.timeout or self.puller.client.timeout,
-                            **self.kw
-                        ) as r:
-                            await event_hooks.aemit("worker.response_get", self, r)
-                            # Iterate over response chunks
-                            # 256KB
-                            async for chunk in r.aiter_bytes(chunk_size=2**18):
-                                await event_hooks.aemit(
-                                    "worker.bytes_get", self, r, chunk)
-                                await f.write(chunk)
-                            await f.flush()
-                            await event_hooks.aemit("worker.success", self, r)
+                    self.downloaded = self._reported = 0
+                    self._reported_at = time.monotonic()
+                    self.total = None
+                    if stored or entry is not None and entry.fresh:
+                        await event_hooks.aemit("worker.cache_hit", self, None)
+                    else:
+                        self._conditions = entry.conditions if entry else {}
+                        await self._pull()
+                    if breaker is not None:
+                        breaker.success(self.key)
+                    value = self._result()
+                    if self.postprocess is not None and value is not None:
+                        # Resolved and destroyed by the stage, its slot is freed now
+                        stage = self.puller.loop.create_task(self._postprocess(value))
+                        self.puller._stages.add(stage)
+                        stage.add_done_callback(self.puller._stages.discard)
+                        staged = True
+                        break
+                    self._journal("done")
                     # set result for placeholder
-                    self.future.set_result(self.path)
-                    self.puller._ft_map.pop(id(self.future))  # type: ignore
+                    self.future.set_result(value)
+                    self.puller._ft_map.pop(id(self.future), None)
                     break  # Quit successfully
-                # Retry on network IO error
-                except (httpx.HTTPError, httpx.StreamError) as e:
+                # Retry on network IO error or corrupted body
+                except (httpx.HTTPError, httpx.StreamError, ChecksumMismatch) as e:
+                    if not policy.retryable(e):
+                        if breaker is not None \
+                                and isinstance(e, httpx.HTTPStatusError):
+                            breaker.success(self.key)  # The host is up
+                        raise
+                    if breaker is not None:
+                        breaker.failure(self.key)
                     retry += 1
                     if retry > self.max_retry:
                         raise MaxRetryReached(
                             f"Max retry reached: {retry} times") from e
                     await event_hooks.aemit("worker.retry", self, e, retry)
-                    await asyncio.sleep(min(30, 1.7 ** retry))
+                    wait = policy.delay(e, retry, wait)
+                    await asyncio.sleep(wait)
         # Fatal Errors
         except (Exception, asyncio.CancelledError) as e:
-            handled = await event_hooks.aemit("worker.fail", self, e)
-            if True not in handled:
-                self.future.set_exception(e)
+            if not await self._fail(e):
                 raise e
-            self.puller._ft_map.pop(id(self.future))  # type: ignore
         finally:
-            await event_hooks.aemit("worker.destroy", self)
+            if self.puller.retry_policy.breaker is not None:
+                self.puller.retry_policy.breaker.release(self.key)
+            if self.puller.store is not None and self._state is None \
+                    and self._target:
+                with suppress(FileNotFoundError):
+                    os.remove(self._target)  # Left by a failed attempt
+            if not staged:
+                await event_hooks.aemit("worker.destroy", self)
             self.puller._workers.get_nowait()
             self.puller._workers.task_done()  # workers count - 1
 
+    async def _fail(self, e: BaseException) -> bool:
+        """
+        Fail the job with `e` unless a `worker.fail` hook handles it,
+        returns whether one did.
+        """
+        self._journal("failed", f"{type(e).__name__}: {e}")
+        handled = await self.event_hooks.aemit("worker.fail", self, e)
+        if True not in handled:
+            self.future.set_exception(e)
+            return False
+        self.puller._forget(self.future)
+        self.puller._land_flight(self, e)  # Never resolved, tell followers
+        return True
+
+    async def reject(self, e: Exception) -> None:
+        """Fail the pending job with `e` without running it."""
+        try:
+            await self.event_hooks.aemit("worker.start", self)
+            await self._fail(e)
+        finally:
+            await self.event_hooks.aemit("worker.destroy", self)
+            self.puller._buffer.task_done()
+
+    def _result(self) -> Any:
+        """What the future of a successful pull resolves to."""
+        if self._memory is not None:
+            return self._memory.getvalue()
+        if isinstance(self.sink, TarSink):
+            return self.sink.directory
+        return self.path
+
+    async def _postprocess(self, value: Any) -> None:
+        """
+        Run `postprocess` on `value` in the pool of the puller,
+        then resolve the future with its result or fail like any worker.
+        """
+        try:
+            try:
+                result = await self.puller._run_postprocess(
+                    self.postprocess, value)  # type: ignore[arg-type]
+            except Exception as e:
+                if not self.future.done():
+                    await self._fail(e)  # Raised by join unless handled
+                return
+            self._journal("done")
+            if not self.future.done():
+                self.future.set_result(result)
+            self.puller._ft_map.pop(id(self.future), None)
+        finally:
+            await self.event_hooks.aemit("worker.destroy", self)
+
+    def _journal(self, status: str, error: str | None = None) -> None:
+        """Record the status of the job in the journal, if any."""
+        if self.puller.journal is not None and self.job_id is not None:
+            self.puller.journal.update(self.job_id, status, error)
+
+    def _headers(self, **extra: str) -> httpx.Headers:
+        """Extra headers of this worker, updated with `extra`."""
+        headers = httpx.Headers(self.extra_headers)
+        headers.update(self._conditions)
+        headers.update(extra)
+        return headers
+
+    async def _cached(self) -> CacheEntry | None:
+        """The cache entry of the file at `path`, if any."""
+        cache = self.puller.cache
+        if cache is None or not self.path or self.method.upper() != "GET":
+            return None
+        self._cache_key = str(self.puller.client.build_request(
+            "GET", self.url, params=self.extra_params).url)
+        entry = await cache.get(self._cache_key)
+        if entry is None or entry.path != os.fspath(self.path) \
+                or not os.path.exists(self.path):
+            return None
+        return entry
+
+    async def _linked(self) -> bool:
+        """Link `path` to the stored blob of the known digest, if any."""
+        store = self.puller.store
+        if store is None or not self.digest or not self.path:
+            return False
+        run = self.puller.writers.run
+        if not await run(store.has, self.digest):
+            return False
+        await run(store.link, self.digest, self.path)
+        return True
+
+    def _algorithms(self) -> set[str]:
+        """Algorithms the body has to be hashed with."""
+        names = set(self.checksum.digests) if self.checksum else set()
+        if self.puller.store is not None and self.path:
+            names.add(self.puller.store.algorithm)
+        return names
+
+    async def _verify(self, feed: HashFeed) -> None:
+        """Check the body against `checksum`, dropping it on mismatch."""
+        if self.checksum is None:
+            return
+        try:
+            self.checksum.verify(feed)
+        except ChecksumMismatch:
+            if self._state is not None:
+                await async_run(self._state.discard)  # Don't resume from it
+            elif self._target:
+                with suppress(FileNotFoundError):
+                    await async_run(os.remove, self._target)
+            raise
+
+    async def _land(self) -> None:
+        """
+        Verify the completed body and move it to its path,
+        through the store if any.
+        """
+        store = self.puller.store
+        state = self._state
+        run = self.puller.writers.run
+        feed, self._feed = self._feed, None
+        if feed is not None:
+            await feed.finish()
+        elif self._target and (self.checksum or self._algorithms()):
+            # Not written in order, hash the file instead
+            feed = await run(HashFeed.of_file, self._target, self._algorithms())
+        if feed is not None:
+            await self._verify(feed)
+        if store is None or not self.path:
+            if state is not None:
+                await async_run(state.commit)
+            return
+        self.digest = feed.hexdigest(store.algorithm)  # type: ignore[union-attr]
+        await run(store.ingest, self._target, self.digest)
+        await run(store.link, self.digest, self.path)
+        if state is not None:
+            await async_run(state.discard)
+
+    async def _pull(self) -> None:
+        """Make one attempt to pull the file."""
+        cache = self.puller.cache
+        hedged = bool(self.mirrors) and self._state is None
+        probe = await self._probe() if self.segments > 1 and not hedged else None
+        if hedged:
+            r = await self._pull_hedged()
+        elif probe is not None and probe.status_code == 304:
+            r = probe
+        elif probe is not None and self._splittable(probe):
+            r = await self._pull_segmented(probe)
+        else:
+            r = await self._pull_stream()
+        if cache is None or not self._cache_key:
+            return
+        if r.status_code == 304:
+            await cache.refresh(self._cache_key, r.headers)
+            await self.event_hooks.aemit("worker.cache_hit", self, r)
+        elif r.status_code == 200:
+            await cache.put(self._cache_key, self.path, r.headers)  # type: ignore
+
+    async def _transfer(self, r: Response, f, piece: list | None = None,
+                        racer: _Racer | None = None) -> None:
+        """
+        Write the body of `r` to `f`.
+        If `piece` is given, its validated offset is advanced and checkpointed
+        to the sidecar of the resumable state as data are flushed.
+        If `racer` is given, the body is hashed by its feed and counts
+        in the progress of the worker while it leads the race.
+        """
+        state = self._state
+        bytes_get = self.event_hooks["worker.bytes_get"]
+        bandwidth = self.puller.bandwidth
+        feed = racer.feed if racer is not None else self._feed
+        received = 0
+        pos = piece[0] if piece is not None else 0
+        share = bandwidth.flow(self.key, self) if bandwidth is not None \
+            else nullcontext()
+        try:
+            with share:  # Hold a share of the bandwidth while streaming
+                async for chunk in self._chunks(r):
+                    delta = r.num_bytes_downloaded - received
+                    received = r.num_bytes_downloaded
+                    self.puller.downloaded += delta
+                    if racer is None:
+                        self.downloaded += delta
+                    else:
+                        racer.downloaded += delta
+                        self._lead(racer)
+                    if bandwidth is not None:
+                        await bandwidth.throttle(self.key, delta, self)
+                    if bytes_get:  # Skip the gather if nobody listens
+                        await bytes_get.atrigger("worker.bytes_get", self, r, chunk)
+                    await self._progress()
+                    if feed is not None:
+                        await feed.update(chunk)
+                    await f.write(chunk)
+                    pos += len(chunk)
+                    if piece is not None \
+                            and pos - piece[0] >= self.checkpoint_size:
+                        await f.flush()
+                        piece[0] = pos
+                        await state.asave()  # type: ignore[union-attr]
+        finally:
+            if piece is not None and pos != piece[0]:
+                await f.flush()
+                piece[0] = pos
+                await state.asave()  # type: ignore[union-attr]
+
+    async def _chunks(self, r: Response) -> AsyncIterator[bytes]:
+        """
+        Iterate the body of `r` in chunks holding about `chunk_period`
+        seconds of the observed throughput, within the chunk size bounds
+        of the puller and never much more than the rest of the body.
+
+        Fast transfers get few large chunks, cutting the cost of events
+        and writes per byte, slow ones keep small buffers.
+        """
+        lo, hi = self.puller.min_chunk_size, self.puller.max_chunk_size
+        remaining = -1
+        if r.headers.get("Content-Encoding", "identity") == "identity":
+            remaining = int(r.headers.get("Content-Length", -1))
+        size = min(lo, remaining) if remaining > 0 else lo
+        chunks: list[bytes] = []
+        buffered = 0
+        since = time.monotonic()
+        async for data in r.aiter_bytes():  # As they arrive
+            chunks.append(data)
+            buffered += len(data)
+            if buffered < size:
+                continue
+            yield chunks[0] if len(chunks) == 1 else b"".join(chunks)
+            now = time.monotonic()
+            rate = buffered / max(now - since, 1e-3)
+            size = min(max(int(rate * self.chunk_period), lo), hi)
+            if remaining > 0:
+                remaining -= buffered
+                size = min(size, max(remaining, 1))
+            chunks, buffered, since = [], 0, now
+        if chunks:
+            yield b"".join(chunks)
+
+    async def _progress(self, force: bool = False) -> None:
+        """
+        Emit `worker.progress` once `progress_bytes` bytes were received
+        or `progress_interval` seconds passed since the last one.
+        """
+        progress = self.event_hooks["worker.progress"]
+        if not progress:
+            return
+        now = time.monotonic()
+        if not force \
+                and self.downloaded - self._reported < self.puller.progress_bytes \
+                and now - self._reported_at < self.puller.progress_interval:
+            return
+        self._reported, self._reported_at = self.downloaded, now
+        await progress.atrigger(
+            "worker.progress", self, self.downloaded, self.total)
+
+    async def _pull_stream(self) -> Response:
+        """Pull the whole body over a single stream."""
+        event_hooks = self.event_hooks
+        state = self._state
+        headers = self._headers() if self._conditions else self.extra_headers
+        pos = 0
+        if state is not None:
+            headers = self._headers(**{"Accept-Encoding": "identity"})
+            if len(state.pieces) == 1 and state.pieces[0][0] and state.validator:
+                pos = state.pieces[0][0]
+                headers["Range"] = f"bytes={pos}-"
+                headers["If-Range"] = state.validator
+        # Establish connection
+        async with self.puller.client.stream(
+            method=self.method,
+            url=self.url,
+            params=self.extra_params,
+            headers=headers,
+            cookies=self.extra_cookies,
+            timeout=self.timeout or self.puller.client.timeout,
+            **self.kw
+        ) as r:
+            if r.status_code == 304 and self._conditions:
+                return r  # Cached file is still valid
+            await event_hooks.aemit("worker.response_get", self, r)
+            if self.puller.retry_policy.raises(r.status_code):
+                r.raise_for_status()
+            piece = None
+            if state is not None:
+                if r.status_code == 416:
+                    await async_run(state.discard)  # Start over on retry
+                r.raise_for_status()  # Never clobber the partial body
+                if r.status_code != 206 or not r.headers.get(
+                        "Content-Range", "").startswith(f"bytes {pos}-"):
+                    pos = 0  # Validator changed or range ignored
+                    size = r.headers.get("Content-Length")
+                    encoded = r.headers.get("Content-Encoding", "identity")
+                    state.reset(r, [[0, int(size) if size else None]]
+                                if encoded == "identity" else [])
+                piece = state.pieces[0] if state.pieces else None
+            length = r.headers.get("Content-Length")
+            self.total = int(length) if length else None
+            if r.headers.get("Content-Encoding", "identity") != "identity":
+                length = None  # Size after decoding is unknown
+            algorithms = self._algorithms()
+            self._feed = HashFeed(algorithms) \
+                if not pos and (self.checksum or algorithms) else None
+            async with self._open(pos, pos + int(length) if length else None) as f:
+                await self._transfer(r, f, piece)
+                await f.flush()
+            await self._progress(force=True)
+            await self._land()
+            await event_hooks.aemit("worker.success", self, r)
+        return r
+
+    async def _pull_hedged(self) -> Response:
+        """
+        Race the url and its mirrors, each into a target of its own.
+        The next one starts once the racers so far failed, or once
+        `hedge_delay` passed without a healthy racer, one past its first
+        byte and at `hedge_rate` or above. The first to finish wins,
+        the others are cancelled.
+        """
+        pending = [self.url, *self.mirrors]
+        tasks: dict[asyncio.Task, _Racer] = {}
+        error: BaseException | None = None
+
+        def start() -> None:
+            index = len(self.mirrors) + 1 - len(pending)
+            racer = _Racer(pending.pop(0), f"{self._target}.hedge{index}"
+                           if self._target else "")
+            tasks[self.puller.loop.create_task(self._race(racer))] = racer
+
+        def healthy(racer: _Racer) -> bool:
+            return racer.received > 0 and (
+                self.hedge_rate is None or racer.rate() >= self.hedge_rate)
+
+        start()
+        winner: _Racer | None = None
+        try:
+            while winner is None:
+                done, _ = await asyncio.wait(
+                    tasks, timeout=self.hedge_delay if pending else None,
+                    return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    racer = tasks.pop(task)
+                    if task.exception() is None:
+                        winner = racer
+                        break
+                    error = task.exception()
+                    await self._drop(racer)
+                if winner is not None:
+                    break
+                if not tasks and not pending:
+                    raise error  # type: ignore[misc]
+                if pending and (not tasks or not done
+                                and not any(map(healthy, tasks.values()))):
+                    start()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            for racer in tasks.values():
+                await self._drop(racer)
+        if winner.target:
+            await self.puller.writers.run(os.replace, winner.target, self._target)
+        self._memory, self._feed = winner.memory, winner.feed
+        self.downloaded, self.total = winner.downloaded, winner.total
+        self._leading = None
+        await self._progress(force=True)
+        await self._land()
+        await self.event_hooks.aemit("worker.success", self, winner.response)
+        return winner.response  # type: ignore[return-value]
+
+    def _lead(self, racer: _Racer) -> None:
+        """Count the progress of `racer` if it's ahead of the leading one."""
+        leading = self._leading
+        if leading is not None and leading is not racer \
+                and leading.received >= racer.received:
+            return
+        self._leading = racer
+        self.downloaded, self.total = racer.downloaded, racer.total
+
+    async def _drop(self, racer: _Racer) -> None:
+        """Remove what a losing racer wrote."""
+        if self._leading is racer:
+            self._leading = None
+        if racer.target:
+            with suppress(FileNotFoundError):
+                await self.puller.writers.run(os.remove, racer.target)
+
+    async def _race(self, racer: _Racer) -> None:
+        """Pull the whole body from the url of `racer` into its target."""
+        async with self.puller.client.stream(
+            method=self.method,
+            url=racer.url,
+            params=self.extra_params,
+            headers=self.extra_headers,
+            cookies=self.extra_cookies,
+            timeout=self.timeout or self.puller.client.timeout,
+            **self.kw
+        ) as r:
+            racer.response = r
+            await self.event_hooks.aemit("worker.response_get", self, r)
+            if self.puller.retry_policy.raises(r.status_code):
+                r.raise_for_status()
+            length = r.headers.get("Content-Length")
+            racer.total = int(length) if length else None
+            self._lead(racer)
+            if r.headers.get("Content-Encoding", "identity") != "identity":
+                length = None
+            algorithms = self._algorithms()
+            if self.checksum or algorithms:
+                racer.feed = HashFeed(algorithms)
+            async with AsyncExitStack() as stack:
+                f: Any
+                if self.sink == "memory":
+                    f = racer.memory = MemorySink(int(length) if length else None)
+                elif racer.target:
+                    f = await stack.enter_async_context(
+                        self.puller.writers.open(racer.target, "wb"))
+                else:
+                    f = Dummyf()
+                await self._transfer(r, f, racer=racer)
+                await f.flush()
+
+    @asynccontextmanager
+    async def _open(self, pos: int, size: int | None) -> AsyncIterator[Any]:
+        """
+        Open the target to write from `pos` onwards, truncating the rest.
+        `size` is the final size of the file, if known.
+        """
+        writers = self.puller.writers
+        if self.sink == "memory":
+            self._memory = MemorySink(size)  # Anew for each attempt
+            yield self._memory
+        elif isinstance(self.sink, TarSink):
+            async with self.sink:
+                yield self.sink
+        elif self.sink is not None:
+            yield CallbackSink(self.sink)
+        elif not self._target:  # Write to void
+            yield Dummyf()
+        elif self.puller.write_strategy == "pwrite":
+            async with writers.open_positional(self._target, not pos) as pf:
+                if pos:
+                    await pf.truncate(pos)
+                if size:
+                    await pf.allocate(size)
+                yield pf.cursor(pos)
+        else:
+            async with writers.open(self._target, "r+b" if pos else "wb") as f:
+                if pos:
+                    await f.seek(pos)
+                    await f.truncate()
+                yield f
+
+    async def _probe(self) -> Response | None:
+        """
+        Send a `HEAD` request to learn whether the body can be pulled
+        in byte ranges, returns `None` if it's not applicable.
+        """
+        if not self.path or self.method.upper() != "GET":
+            return None
+        r = await self.puller.client.head(
+            url=self.url,
+            params=self.extra_params,
+            headers=self._headers(**{"Accept-Encoding": "identity"}),
+            cookies=self.extra_cookies,
+            timeout=self.timeout or self.puller.client.timeout,
+        )
+        return r
+
+    def _splittable(self, r: Response) -> bool:
+        """Whether the body described by `r` is worth pulling in ranges."""
+        if r.status_code != 200 \
+                or r.headers.get("Accept-Ranges", "").lower() != "bytes" \
+                or r.headers.get("Content-Encoding", "identity") != "identity":
+            return False
+        size = int(r.headers.get("Content-Length", 0))
+        return size >= 2 * self.puller.min_segment_size
+
+    async def _pull_segmented(self, probe: Response) -> Response:
+        """Pull the body in concurrent byte ranges into a preallocated file."""
+        event_hooks = self.event_hooks
+        state = self._state
+        size = int(probe.headers["Content-Length"])
+        self._conditions = {}  # Ranges are pulled unconditionally
+        self._feed = None  # Ranges arrive out of order
+        resumed = state is not None and state.matches(probe) \
+            and bool(state.pieces) and state.pieces[-1][1] == size
+        if resumed:
+            pieces = state.pieces  # type: ignore[union-attr]
+        else:
+            count = min(self.segments, size // self.puller.min_segment_size)
+            step = -(-size // count)  # ceil division
+            pieces = [[start, min(start + step, size)]
+                      for start in range(0, size, step)]
+        async with AsyncExitStack() as stack:
+            shared = None
+            if self.puller.write_strategy == "pwrite":
+                shared = await stack.enter_async_context(
+                    self.puller.writers.open_positional(self._target, not resumed))
+                if not resumed:
+                    await shared.allocate(size)
+            elif not resumed:
+                async with self.puller.writers.open(self._target, "wb") as f:
+                    await f.truncate(size)  # preallocate
+            if state is not None and not resumed:
+                state.reset(probe, pieces)
+                await state.asave()
+            self.total = sum(end - start for start, end in pieces)
+            await event_hooks.aemit("worker.response_get", self, probe)
+            tasks = [
+                self.puller.loop.create_task(self._pull_range(piece, shared))
+                for piece in pieces if piece[0] < piece[1]
+            ]
+            try:
+                await asyncio.gather(*tasks)
+            finally:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+        await self._progress(force=True)
+        await self._land()
+        await event_hooks.aemit("worker.success", self, probe)
+        return probe
+
+    async def _pull_range(self, piece: list,
+                          shared: PositionalFile | None = None) -> None:
+        """
+        Pull bytes `[start, end)` of `piece` and write them at their offset,
+        through a cursor of `shared` if given.
+        """
+        state = self._state
+        start, end = piece
+        headers = self._headers(**{
+            "Accept-Encoding": "identity",
+            "Range": f"bytes={start}-{end - 1}",
+        })
+        if state is not None and state.validator:
+            headers["If-Range"] = state.validator
+        async with AsyncExitStack() as stack:
+            if shared is not None:
+                f: Any = shared.cursor(start)
+            else:
+                f = await stack.enter_async_context(
+                    self.puller.writers.open(self._target, "r+b"))
+                await f.seek(start)
+            async with self.puller.client.stream(
+                method="GET",
+                url=self.url,
+                params=self.extra_params,
+                headers=headers,
+                cookies=self.extra_cookies,
+                timeout=self.timeout or self.puller.client.timeout,
+                **self.kw
+            ) as r:
+                if r.status_code != 206:
+                    r.raise_for_status()
+                    # Ranges ignored or validator changed, start over on retry
+                    self.segments = 1
+                    if state is not None:
+                        state.pieces = []
+                    raise httpx.RemoteProtocolError(
+                        f"Range request answered with {r.status_code}",
+                        request=r.request)
+                await self._transfer(
+                    r, f, piece if state is not None else None)
+            await f.flush()
+
     def __repr__(self) -> str:
         return f"AsynWorker({self.url}, {self.path})"
 
 
 class AsyncMaster(BaseMaster):
+    """
+    Spawns pending workers by priority, deadline and arrival order,
+    under the global, per-host concurrency and rate limits of the puller.
+    A blocked host never holds back the others.
+
+    Runnable keys sit in one heap ordered by the head of their own heap,
+    keys blocked by a rate or the breaker in a heap of timers, and only
+    keys whose state changed are looked at again, so spawning costs
+    `O(log n)` however many keys are pending.
+    """
+
     def __init__(self, puller: AsyncPuller):
         self.puller = puller
+        self._pending: dict[str, list[list]] = {}
+        """Heaps of `[-priority, deadline, seq, worker]` by key"""
+        self._jobs: dict[int, list] = {}
+        """Heap entries by future id, removed entries hold `None` as worker"""
+        self._seq = 0
+        self._killed = False
+        self._running: dict[str, int] = {}
+        self._buckets: dict[str, tuple[HostLimit, TokenBucket]] = {}
+        self._ready: list[tuple[int, float, int, str]] = []
+        """Heap of `(-priority, deadline, seq, key)` of the heads of runnable keys"""
+        self._queued: dict[str, tuple[int, float, int, str]] = {}
+        """Current item of each key in `_ready`, other items are stale"""
+        self._timers: list[tuple[float, str]] = []
+        """Heap of `(time, key)` of keys blocked until then"""
+        self._timed: dict[str, float] = {}
+        """Earliest timer of each key in `_timers`"""
+        self._dirty: set[str] = set()
+        """Keys to look at again"""
+        self._next_spawn = 0.0
+        self._wakeup = asyncio.Event()
+
+    def wake(self) -> None:
+        """Ask the master to look for runnable workers again."""
+        self._wakeup.set()
+
+    def _push(self, worker: AsyncWorker, seq: int | None = None) -> None:
+        if seq is None:
+            seq, self._seq = self._seq, self._seq + 1
+        deadline = math.inf if worker.deadline is None else worker.deadline
+        entry = [-worker.priority, deadline, seq, worker]
+        heapq.heappush(self._pending.setdefault(worker.key, []), entry)
+        self._jobs[id(worker.future)] = entry
+        self._dirty.add(worker.key)
+
+    def _drain(self) -> None:
+        """Move new workers from the buffer of the puller to the heaps."""
+        buffer = self.puller._buffer
+        while not buffer.empty():
+            worker = buffer.get_nowait()
+            if worker is None:  # Kill signal
+                buffer.task_done()
+                self._killed = True
+                self.wake()
+            else:
+                self._push(worker)
+
+    def _discard(self, entry: list) -> None:
+        """Drop a cancelled pending worker."""
+        worker: AsyncWorker = entry[-1]
+        entry[-1] = None
+        worker._journal("cancelled")
+        self._jobs.pop(id(worker.future), None)
+        self.puller._ft_map.pop(id(worker.future), None)
+        self.puller._buffer.task_done()
+
+    def cancel(self, future: Future) -> bool:
+        """Cancel a pending job, returns whether it was pending."""
+        self._drain()
+        entry = self._jobs.get(id(future))
+        if entry is None:
+            return False
+        self._discard(entry)
+        future.cancel()
+        return True
+
+    def reprioritize(self, future: Future, priority: int | None = None,
+                     deadline: float | None = None) -> bool:
+        """Reorder a pending job, returns whether it was pending."""
+        self._drain()
+        entry = self._jobs.get(id(future))
+        if entry is None:
+            return False
+        worker: AsyncWorker = entry[-1]
+        entry[-1] = None
+        if priority is not None:
+            worker.priority = priority
+        if deadline is not None:
+            worker.deadline = time.monotonic() + deadline
+        self._push(worker, seq=entry[2])  # Keep FIFO order among ties
+        self.wake()
+        return True
+
+    def _fail(self, key: str, e: Exception) -> None:
+        """Fail all pending workers of `key` with `e`, like failed workers."""
+        for entry in self._pending.pop(key, []):
+            worker: AsyncWorker | None = entry[-1]
+            if worker is None:
+                continue
+            if worker.future.done():  # Cancelled by the user
+                self._discard(entry)
+                continue
+            entry[-1] = None
+            self._jobs.pop(id(worker.future), None)
+            self.puller.loop.create_task(worker.reject(e))
+
+    def _bucket(self, key: str, limit: HostLimit) -> TokenBucket | None:
+        if limit.rate is None:
+            return None
+        if key not in self._buckets or self._buckets[key][0] is not limit:
+            self._buckets[key] = (limit, TokenBucket(limit.rate, limit.burst))
+        return self._buckets[key][1]
+
+    def _spawn(self, worker: AsyncWorker) -> None:
+        key = worker.key
+        self._jobs.pop(id(worker.future), None)
+        self._running[key] = self._running.get(key, 0) + 1
+
+        def release(_):
+            self._running[key] -= 1
+            if not self._running[key]:
+                del self._running[key]
+            self._dirty.add(key)
+            self.wake()
+
+        if self.puller.retry_policy.breaker is not None:
+            self.puller.retry_policy.breaker.acquire(key)
+        self.puller._workers.put_nowait(worker)
+        self.puller.loop.create_task(worker.run()).add_done_callback(release)
+        self.puller._buffer.task_done()
+
+    def _check(self, key: str, now: float) -> list | None:
+        """
+        Drop the removed heads of `key` and return the head if it can be
+        spawned now. Otherwise it's looked at again once a worker of `key`
+        finishes, or once the timer it gets expires.
+        """
+        puller = self.puller
+        breaker = puller.retry_policy.breaker
+        heap = self._pending.get(key)
+        while heap and (heap[0][-1] is None or heap[0][-1].future.done()):
+            entry = heapq.heappop(heap)
+            if entry[-1] is not None:  # Cancelled by the user
+                self._discard(entry)
+        if not heap:
+            self._pending.pop(key, None)
+            return None
+        limit = puller.limit_of(key)
+        if limit.max_workers is not None \
+                and self._running.get(key, 0) >= limit.max_workers:
+            return None
+        bucket = self._bucket(key, limit)
+        wait = bucket.delay() if bucket is not None else 0
+        if breaker is not None:
+            if breaker.fail_fast and breaker.state(key) == "open":
+                self._fail(key, CircuitOpen(f"Circuit of {key} is open"))
+                return None
+            wait = max(wait, breaker.delay(key))
+        if wait:
+            when = now + wait
+            if when < self._timed.get(key, math.inf):
+                self._timed[key] = when
+                heapq.heappush(self._timers, (when, key))
+            return None
+        return heap[0]
+
+    def _queue(self, key: str, now: float) -> None:
+        """Put `key` in the ready heap by its head, if it can be spawned now."""
+        self._queued.pop(key, None)
+        head = self._check(key, now)
+        if head is not None:
+            item = (head[0], head[1], head[2], key)
+            self._queued[key] = item
+            heapq.heappush(self._ready, item)
+
+    def _dispatch(self) -> float | None:
+        """
+        Spawn runnable pending workers, most urgent first.
+        Returns seconds until a blocked worker may become runnable,
+        or `None` if only a finished worker or a new job can change that.
+        """
+        puller = self.puller
+        now = time.monotonic()
+        while self._timers and self._timers[0][0] <= now:
+            when, key = heapq.heappop(self._timers)
+            if self._timed.get(key) == when:
+                del self._timed[key]
+                self._dirty.add(key)
+        dirty, self._dirty = self._dirty, set()
+        for key in dirty:
+            self._queue(key, now)
+        while self._ready:
+            if puller._workers.qsize() >= puller.max_workers:
+                return None
+            now = time.monotonic()
+            if now < self._next_spawn:
+                return self._next_spawn - now
+            item = heapq.heappop(self._ready)
+            key = item[-1]
+            if self._queued.get(key) is not item:
+                continue  # Stale
+            head = self._check(key, now)
+            if head is None or tuple(head[:3]) != item[:3]:
+                self._queue(key, now)  # Changed since it was queued
+                continue
+            del self._queued[key]
+            worker: AsyncWorker = heapq.heappop(self._pending[key])[-1]
+            bucket = self._bucket(key, puller.limit_of(key))
+            if bucket is not None:
+                bucket.acquire()
+            self._spawn(worker)
+            self._queue(key, now)  # The next one of the same key
+            if puller.interval:
+                self._next_spawn = now + puller.interval
+        if not self._timers:
+            return None
+        return max(self._timers[0][0] - time.monotonic(), 0)
 
     async def run(self):
         """Run the master."""
         try:
-            buffer = self.puller._buffer
-            workers = self.puller._workers
             while True:
-                worker = await buffer.get()
-                if worker is None:  # Kill signal
-                    buffer.task_done()
-                    break
-                await workers.put(worker)  # blocks when max_workers reached
-                self.puller.loop.create_task(worker.run())
-                buffer.task_done()
-                await asyncio.sleep(self.puller.interval)  # sleep a while
+                self._wakeup.clear()
+                self._drain()
+                if self._killed:
+                    return
+                delay = self._dispatch()
+                with suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
         finally:
             self.puller._master = None  # Reset master
 
@@ -206,9 +1230,34 @@ class AsyncPuller(BasePuller):
         event_hooks: Mapping[str, Sequence[Callable]] = None,
         interval: float = 0.0,
         max_workers: int = 8,
+        max_per_host: int | None = None,
+        rate_per_host: float | None = None,
+        burst_per_host: float = 1,
+        host_limits: Mapping[str, HostLimit] | None = None,
         timeout: Timeout | float | None = 10,
         retry: int = 3,
         overwrite: bool = False,
+        segments: int = 1,
+        min_segment_size: int = 2**20,
+        resume: bool = False,
+        cache: PullerCache | str | os.PathLike | None = None,
+        journal: PullerJournal | str | os.PathLike | None = None,
+        store: BlobStore | str | os.PathLike | None = None,
+        writer_threads: int = 4,
+        write_buffer_size: int = 2**20,
+        write_strategy: Literal["stream", "pwrite"] = "stream",
+        progress_bytes: int = 2**22,
+        progress_interval: float = 0.1,
+        min_chunk_size: int = 2**16,
+        max_chunk_size: int = 2**22,
+        concurrency: AIMDController | None = None,
+        retry_policy: RetryPolicy | None = None,
+        metrics: PullerMetrics | None = None,
+        postprocess: Callable[[Any], Any] | None = None,
+        postprocess_workers: int | None = None,
+        postprocess_executor: Executor | None = None,
+        coalesce: bool = False,
+        bandwidth: BandwidthLimiter | None = None,
         loop: asyncio.AbstractEventLoop = None,
         **kw
     ):
@@ -220,9 +1269,58 @@ class AsyncPuller(BasePuller):
         * `event_hooks`: dict[str, Iterable[Callable]]
         * `interval`: Interval between each request
         * `max_workers`: Max downloading threads count
+        * `max_per_host`: Max downloading threads count of each host
+        * `rate_per_host`: Max requests per second to each host
+        * `burst_per_host`: Max requests at once to each host under `rate_per_host`
+        * `host_limits`: `HostLimit` by host (or `limit_key`), overriding the above
         * `timeout`: Timeout for each request
         * `retry`: Max retry times for each request
         * `overwrite`: Overwrite existing files
+        * `segments`: Max concurrent byte ranges to split each file into,
+        servers without range support fall back to a single stream
+        * `min_segment_size`: Min size in bytes of each byte range
+        * `resume`: Pull into `<path>.part` and keep the progress in
+        `<path>.part.json`, so retries and later runs continue where they stopped
+        * `cache`: `PullerCache` or path of its database, fresh files are not
+        pulled again and stale ones are revalidated with conditional requests
+        * `journal`: `PullerJournal` or path of its database, recording jobs
+        so `recover` can pull the unfinished ones after a crash
+        * `store`: `BlobStore` or its root directory, bodies are stored once
+        under their digest and each `path` is linked to them
+        * `writer_threads`: Max threads writing files, shared by all workers
+        * `write_buffer_size`: Bytes buffered by each file before they are
+        written in one go
+        * `write_strategy`: `"stream"` writes files sequentially,
+        `"pwrite"` reserves the known size of files up front and writes
+        at explicit offsets, which avoids fragmentation and fails early
+        on a full disk
+        * `progress_bytes`: `worker.progress` is emitted once this many bytes
+        were received since the last one
+        * `progress_interval`: or once this many seconds passed
+        * `min_chunk_size`, `max_chunk_size`: Bounds in bytes of the chunks
+        bodies are read in, sized to the observed throughput
+        * `concurrency`: Controller resizing `max_workers` at runtime
+        from throughput and congestion feedback
+        * `retry_policy`: Which failures are retried and how long to wait,
+        set to None to retry every network error with backoff
+        `min(30, 1.7 ** retry)`
+        * `metrics`: Counters and histograms of jobs, fed by worker events,
+        see `PullerMetrics.snapshot` and `PullerMetrics.render`
+        * `postprocess`: Picklable function run on the path (or body)
+        of each pulled file in a process pool, the `Future` of the job
+        resolves to its result. Workers are freed before it runs,
+        so downloads and CPU work overlap
+        * `postprocess_workers`: Max files processed at once,
+        set to None will use CPU count
+        * `postprocess_executor`: Executor running `postprocess`,
+        set to None will use a `ProcessPoolExecutor` of the puller
+        * `coalesce`: Identical `GET` pulls in flight at once, by url,
+        params, headers and cookies, share one transfer, other paths get
+        a reflink, hard link or copy of the file. Options of the first win,
+        pulls with a checksum, digest or extra httpx options never share.
+        Cancelling one of them leaves the transfer to the others
+        * `bandwidth`: Caps bytes per second received, overall and by host,
+        split evenly between active workers, adjustable at runtime
         * `loop`: Event loop
         * `**kw`: Other keyword arguments for httpx.Client
         """
@@ -230,13 +1328,48 @@ class AsyncPuller(BasePuller):
         self.interval = interval
         self.max_retry = max(retry, 0)
         self.overwrite = overwrite
+        self.segments = max(segments, 1)
+        self.min_segment_size = max(min_segment_size, 1)
+        self.resume = resume
+        if write_strategy not in ("stream", "pwrite"):
+            raise ValueError(f"Unknown write strategy: {write_strategy}")
+        self.write_strategy = write_strategy
+        self.progress_bytes = progress_bytes
+        self.progress_interval = progress_interval
+        self.min_chunk_size = max(min_chunk_size, 1)
+        self.max_chunk_size = max(max_chunk_size, self.min_chunk_size)
+        self.writers = WriterPool(writer_threads, write_buffer_size)
+        self._own_cache = False
+        self.cache: PullerCache | None = None
+        if isinstance(cache, PullerCache):
+            self.cache = cache
+        elif cache is not None:
+            self.cache, self._own_cache = PullerCache(cache), True
+        self._own_journal = False
+        self.journal: PullerJournal | None = None
+        if isinstance(journal, PullerJournal):
+            self.journal = journal
+        elif journal is not None:
+            self.journal, self._own_journal = PullerJournal(journal), True
+        self.store: BlobStore | None = None
+        if isinstance(store, BlobStore):
+            self.store = store
+        elif store is not None:
+            self.store = BlobStore(store)
 
         self._proxies = proxies
         self._master: AsyncMaster | None = None
         self._buffer: asyncio.Queue = asyncio.Queue()  # Pending workers
-        self._workers: asyncio.Queue = asyncio.Queue(
-            maxsize=max_workers)  # Running workers
+        self._workers: asyncio.Queue = asyncio.Queue()  # Running workers
+        self._max_workers = max(max_workers, 1)
+        self.downloaded = 0
+        """Bytes received over the wire by all workers"""
+        self.host_limits: dict[str, HostLimit] = dict(host_limits or {})
+        """Limits by host (or `limit_key`), overriding the defaults"""
+        self.default_limit = HostLimit(max_per_host, rate_per_host, burst_per_host)
         self._ft_map: dict[int, Future] = {}
+        self._watchers: list[_Watcher] = []
+        """Watchers of running `as_completed` and `pull_many` iterators"""
 
         limits = httpx.Limits(
             max_connections=None,
@@ -266,11 +1399,160 @@ class AsyncPuller(BasePuller):
 
         self._on = PullerEventHint(
             strchain=StrChain(joint='.', callback=subscribe))
+        self.concurrency = concurrency
+        self.retry_policy = retry_policy or RetryPolicy(
+            jitter=False, retry_after=False, statuses=None, fatal=())
+        if concurrency is not None:
+            concurrency.attach(self)
+        self.metrics = metrics
+        if metrics is not None:
+            metrics.attach(self)
+        self.postprocess = postprocess
+        self.postprocess_workers = max(postprocess_workers or os.cpu_count() or 1, 1)
+        self._post_executor = postprocess_executor
+        self._own_post_executor = False
+        self._post_slots: asyncio.Semaphore | None = None
+        self._stages: set[asyncio.Task] = set()
+        """`postprocess` tasks of workers that freed their slot"""
+        self.coalesce = coalesce
+        self.bandwidth = bandwidth
+        self._flights: dict[tuple, AsyncWorker] = {}
+        """Workers of coalesced pulls in flight by key"""
 
     @property
     def client(self):
         return self._client
 
+    @property
+    def max_workers(self) -> int:
+        """Max running workers, can be changed at runtime."""
+        return self._max_workers
+
+    @max_workers.setter
+    def max_workers(self, value: int):
+        self._max_workers = max(value, 1)
+        if self._master is not None:
+            self._master.wake()
+
+    @property
+    def running(self) -> int:
+        """Workers running now."""
+        return self._workers.qsize()
+
+    @property
+    def pending(self) -> int:
+        """Jobs waiting for a worker."""
+        jobs = len(self._master._jobs) if self._master is not None else 0
+        return jobs + self._buffer.qsize()
+
+    async def _run_postprocess(self, func: Callable[[Any], Any], value: Any) -> Any:
+        """Run `func(value)` in the executor, `postprocess_workers` at a time."""
+        if self._post_executor is None:
+            self._post_executor = ProcessPoolExecutor(
+                self.postprocess_workers,
+                mp_context=multiprocessing.get_context("spawn"))
+            self._own_post_executor = True
+        if self._post_slots is None:
+            self._post_slots = asyncio.Semaphore(self.postprocess_workers)
+        async with self._post_slots:
+            return await self.loop.run_in_executor(self._post_executor, func, value)
+
+    def _flight_key(self, url: str, params: QueryParamTypes | None,
+                    headers: HeaderTypes | None, cookies: CookieTypes | None,
+                    kw: Mapping[str, Any]) -> tuple | None:
+        """Key of pulls sharing one transfer, `None` if they can't."""
+        if kw.get("method", "GET").upper() != "GET" or kw.keys() - {"method"}:
+            return None  # Auth, bodies or redirects may change the response
+        url = str(self.client.build_request("GET", url, params=params).url)
+        return (url, tuple(sorted(httpx.Headers(headers).multi_items())),
+                tuple(sorted(httpx.Cookies(cookies).items())))
+
+    def _land_flight(self, leader: AsyncWorker,
+                     error: BaseException | None = None) -> None:
+        """
+        End the flight of `leader` and resolve its followers,
+        from its future or from `error` if it will never be resolved.
+        """
+        followers, leader._followers = leader._followers, []
+        if error is None and leader.future.cancelled():
+            followers = [f for f in followers if not f.future.done()]
+            if followers:  # Only the last waiter cancels the transfer
+                self._promote(leader, followers)
+                return
+        if self._flights.get(leader._flight) is leader:  # type: ignore[arg-type]
+            del self._flights[leader._flight]  # type: ignore[arg-type]
+        for follower in followers:
+            self.loop.create_task(self._follow(leader, error, follower))
+
+    def _promote(self, leader: AsyncWorker, followers: list[AsyncWorker]) -> None:
+        """
+        Hand the flight of the cancelled `leader` to its first follower,
+        the first one saving a file it may write if others need one.
+        """
+        worker = next((f for f in followers if f.path and (
+            f.overwrite or not os.path.exists(f.path))), followers[0])
+        followers.remove(worker)
+        worker._followers = followers
+        flight, leader._flight = leader._flight, None
+        worker._flight = flight
+        if self._flights.get(flight) is leader:  # type: ignore[arg-type]
+            self._flights[flight] = worker  # type: ignore[index]
+        worker.future.add_done_callback(lambda _: self._land_flight(worker))
+
+        async def enqueue():
+            await self._event_hooks.aemit("worker.spawn", worker)
+            await self._enqueue(worker)
+
+        self.loop.create_task(enqueue())
+
+    def _unfollow(self, future: Future) -> bool:
+        """Cancel the follower of `future`, returns whether it was one."""
+        for leader in self._flights.values():
+            for worker in leader._followers:
+                if worker.future is future:
+                    leader._followers.remove(worker)
+                    worker._journal("cancelled")
+                    self._ft_map.pop(id(future), None)
+                    future.cancel()
+                    return True
+        return False
+
+    async def _follow(self, leader: AsyncWorker, error: BaseException | None,
+                      worker: AsyncWorker) -> None:
+        """
+        Resolve the future of the follower `worker` like `leader`,
+        with a copy of its file, going through the worker events.
+        """
+        future, path = worker.future, worker.path
+        if future.done():  # Cancelled meanwhile
+            return
+        event_hooks = worker.event_hooks
+        try:
+            await event_hooks.aemit("worker.start", worker)
+            if error is not None:
+                raise error
+            leader.future.result()  # Raise its failure
+            if path and os.fspath(path) != os.fspath(leader.path or ""):
+                if os.path.exists(path) and not worker.overwrite:
+                    raise FileExistsError(f"{path} already exists")
+                await self.writers.run(link_file, leader.path, path)  # type: ignore
+            worker._journal("done")
+            future.set_result(path)
+            self._ft_map.pop(id(future), None)
+        except Exception as e:
+            await worker._fail(e)  # Raised by join unless handled
+        finally:
+            await event_hooks.aemit("worker.destroy", worker)
+
+    def limit_of(self, key: str) -> HostLimit:
+        """Limits of the host (or `limit_key`) `key`."""
+        return self.host_limits.get(key, self.default_limit)
+
+    async def _enqueue(self, worker: AsyncWorker | None) -> None:
+        await self._buffer.put(worker)
+        if self._master is not None:
+            self._master.wake()
+
     @property
     def loop(self):
         if self._loop is None:
@@ -335,6 +1617,18 @@ class AsyncPuller(BasePuller):
         timeout: Timeout | float | None = 0,
         retry: int | None = None,
         overwrite: bool | None = None,
+        limit_key: str | None = None,
+        priority: int = 0,
+        deadline: float | None = None,
+        segments: int | None = None,
+        resume: bool | None = None,
+        digest: str | None = None,
+        checksum: Checksum | Mapping[str, Any] | None = None,
+        sink: Literal["memory"] | Consumer | TarSink | None = None,
+        postprocess: Callable[[Any], Any] | None = None,
+        mirrors: Sequence[str] = (),
+        hedge_delay: float | None = None,
+        hedge_rate: float | None = None,
         **kw
     ) -> Future:
         """
@@ -352,8 +1646,55 @@ class AsyncPuller(BasePuller):
         * `timeout`: timeout for this request, set to None will be no limit, 0 for default
         * `retry`: retry times for this request, set to None will use default
         * `overwrite`: overwrite file if exists, set to None will use default
+        * `limit_key`: key of the limits to obey, set to None will use url host
+        * `priority`: jobs with higher priority are started first
+        * `deadline`: seconds from now the job should start by, jobs of
+        the same priority are started by earliest deadline, then in FIFO order
+        * `segments`: max concurrent byte ranges, set to None will use default
+        * `resume`: resume partial pulls, set to None will use default
+        * `digest`: digest of the body if known, the pull is skipped
+        if it's in the store
+        * `checksum`: expected `Checksum` of the body, or a mapping like
+        `{"sha256": "...", "size": 1024}`, verified as the body streams in,
+        mismatches are retried
+        * `sink`: keep the body off the filesystem, `path` must be None.
+        `"memory"` collects it into a `bytearray`, preallocated from
+        `Content-Length`, which the `Future` refers to instead.
+        An async callable is awaited with each chunk in order,
+        chunks of a failed attempt are handed again from the start on retry.
+        A `TarSink` extracts the archive into its directory as it streams in,
+        which the `Future` refers to instead
+        * `postprocess`: function run on the pulled path or body in the
+        process pool, set to None will use default
+        * `mirrors`: other urls of the same body, tried in order after `url`.
+        The next one is raced once the ones so far failed, or once
+        `hedge_delay` seconds passed without any of them past its first byte
+        and at `hedge_rate` bytes per second or above. The first to finish
+        wins, the others are cancelled. Not used when resuming
+        * `hedge_delay`: seconds before hedging, set to None will only
+        switch mirrors on failure
+        * `hedge_rate`: min bytes per second before hedging
         * `**kw`: extra keyword arguments for httpx.stream
         """
+        if sink is not None and path:
+            raise ValueError("A sink replaces path, pass None as path")
+        if sink is not None and sink != "memory" and not callable(sink) \
+                and not isinstance(sink, TarSink):
+            raise ValueError(f"Unknown sink: {sink!r}")
+        if mirrors and sink not in (None, "memory"):
+            raise ValueError("Only memory sinks can be raced across mirrors")
+        job_id = None
+        if self.journal is not None:
+            options = dict(
+                extra_headers=extra_headers, extra_params=extra_params,
+                extra_cookies=extra_cookies, timeout=timeout, retry=retry,
+                overwrite=overwrite, limit_key=limit_key, priority=priority,
+                deadline=deadline, segments=segments, resume=resume,
+                digest=digest, checksum=checksum, mirrors=list(mirrors) or None,
+                hedge_delay=hedge_delay, hedge_rate=hedge_rate, **kw)
+            await self.journal.open()
+            job_id = self.journal.add(url, path, {
+                k: v for k, v in options.items() if v is not None})
         timeout = self.client.timeout if timeout == 0 else timeout
         self._loop = self.loop or asyncio.get_running_loop()
         if self._master is None:
@@ -361,6 +1702,9 @@ class AsyncPuller(BasePuller):
             self._loop.create_task(self._master.run())
         future: Future = Future()  # A placeholder for the worker.run() task
         self._ft_map[id(future)] = future
+        for watcher in self._watchers:
+            if watcher.every:
+                watcher.watch(future)
         worker = AsyncWorker(
             self,
             url=url,
@@ -372,26 +1716,212 @@ class AsyncPuller(BasePuller):
             timeout=timeout,
             retry=self.max_retry if retry is None else retry,
             overwrite=overwrite or self.overwrite,
+            limit_key=limit_key,
+            priority=priority,
+            deadline=None if deadline is None else time.monotonic() + deadline,
+            segments=self.segments if segments is None else segments,
+            resume=self.resume if resume is None else resume,
+            digest=digest,
+            checksum=checksum,
+            job_id=job_id,
+            sink=sink,
+            postprocess=postprocess or self.postprocess,
+            mirrors=mirrors,
+            hedge_delay=hedge_delay,
+            hedge_rate=hedge_rate,
             **kw
         )
+        flight = None
+        if self.coalesce and sink is None and checksum is None and digest is None \
+                and not (postprocess or self.postprocess):
+            flight = self._flight_key(
+                url, extra_params, extra_headers, extra_cookies, kw)
+        if flight is not None:
+            leader = self._flights.get(flight)
+            if leader is not None and (leader.path or not path):
+                leader._followers.append(worker)  # Never runs itself
+                return future
+            # Leaders must not fail for reasons of their own path
+            if leader is None and (not path or worker.overwrite
+                                   or not os.path.exists(path)):
+                worker._flight = flight
+                self._flights[flight] = worker
+                future.add_done_callback(lambda _: self._land_flight(worker))
         await self._event_hooks.aemit("worker.spawn", worker)
-        await self._buffer.put(worker)
+        await self._enqueue(worker)
         return future
 
+    def cancel(self, future: Future) -> bool:
+        """
+        ### Cancel a job that has not started yet.
+        * `future`: the future returned by `pull`
+
+        Returns whether the job was cancelled.
+        Coalesced pulls are cancelled on their own, the shared transfer
+        only once all of them are.
+        """
+        if self._master is None:
+            return False
+        return self._unfollow(future) or self._master.cancel(future)
+
+    def reprioritize(
+        self,
+        future: Future,
+        priority: int | None = None,
+        deadline: float | None = None,
+    ) -> bool:
+        """
+        ### Change the priority or deadline of a job that has not started yet.
+        * `future`: the future returned by `pull`
+        * `priority`: new priority, set to None will keep it
+        * `deadline`: new deadline in seconds from now, set to None will keep it
+
+        Returns whether the job was changed.
+        """
+        if self._master is None:
+            return False
+        return self._master.reprioritize(future, priority, deadline)
+
+    async def pull_many(
+        self,
+        jobs: AsyncIterable[PullJob] | Iterable[PullJob],
+        window: int | None = None,
+    ) -> AsyncGenerator[tuple[PullJob, Future], None]:
+        """
+        ### Pull files of lots of jobs lazily.
+        Jobs are taken from `jobs` only when there is room in the window,
+        so manifests of any size stream through in constant memory.
+
+        Yields `(job, future)` of each finished job in order of completion,
+        the futures are not gathered by `join`.
+        * `jobs`: (async) iterable of jobs, each being a url, a `(url, path)`
+        tuple or a mapping of keyword arguments for `pull`
+        * `window`: max jobs in flight, set to None will be twice `max_workers`
+        """
+        window = max(window or 2 * self.max_workers, 1)
+        watcher = _Watcher(every=False)
+
+        async def to_aiter(jobs: Iterable[PullJob]):
+            for job in jobs:
+                yield job
+
+        source = aiter(jobs) if isinstance(jobs, AsyncIterable) \
+            else to_aiter(jobs)
+        exhausted = False
+        self._watchers.append(watcher)
+        try:
+            while True:
+                while not exhausted and len(watcher.futures) < window:
+                    try:
+                        job = await anext(source)
+                    except StopAsyncIteration:
+                        exhausted = True
+                        break
+                    if isinstance(job, str):
+                        future = await self.pull(job, None)
+                    elif isinstance(job, Mapping):
+                        future = await self.pull(**job)
+                    else:
+                        future = await self.pull(*job)
+                    self._forget(future)  # Not for join() or as_completed
+                    watcher.watch(future, job)
+                if not watcher.futures:
+                    return
+                # Jobs whose failures are handled by hooks only free their slot
+                got = await watcher.get()
+                if got is not None:
+                    future, job = got
+                    yield job, future
+        finally:
+            self._watchers.remove(watcher)
+            watcher.close()
+
+    async def recover(self) -> list[Future]:
+        """
+        ### Pull the jobs the journal left unfinished, e.g. after a crash.
+        Their old entries are marked `superseded` by the new ones,
+        or `failed` if their options weren't journaled.
+
+        Returns the futures of the jobs.
+        """
+        if self.journal is None:
+            raise RuntimeError("Puller has no journal")
+        futures = []
+        for entry in await self.journal.unfinished():
+            if entry.options is None:
+                self.journal.update(entry.id, "failed", "Options not journaled")
+                continue
+            self.journal.update(entry.id, "superseded")
+            futures.append(await self.pull(entry.url, entry.path, **entry.options))
+        return futures
+
+    def _forget(self, future: Future) -> None:
+        """Stop tracking `future` for `join` and the iterators."""
+        self._ft_map.pop(id(future), None)
+        for watcher in self._watchers:
+            watcher.unwatch(future)
+
+    async def as_completed(self) -> AsyncGenerator[Future, None]:
+        """
+        ### Yield the future of each job as soon as it finishes.
+        Covers jobs running, pending or failed but not joined when
+        iterating starts, and jobs pulled meanwhile, and stops once
+        none is left. `join` won't gather yielded futures,
+        so check their exceptions.
+        Jobs whose failures are handled by hooks are not yielded.
+        """
+        watcher = _Watcher(every=True)
+        for future in self._ft_map.values():
+            watcher.watch(future)
+        self._watchers.append(watcher)
+        try:
+            while watcher.futures:
+                got = await watcher.get()
+                if got is not None:
+                    self._ft_map.pop(id(got[0]), None)
+                    yield got[0]
+        finally:
+            self._watchers.remove(watcher)
+            watcher.close()
+
     async def join(self) -> None:
         """### Wait for all workers to finish."""
         await self._event_hooks.aemit("puller.join", self)
         await self._buffer.join()  # Make sure no pending tasks
         await self._workers.join()  # Make sure all workers finished
-        jobs = list(self._ft_map.values())
+        if self._stages:  # And their postprocess stages
+            await asyncio.wait(self._stages)
+        # Make sure all tasks are done, followers of coalesced pulls
+        # finish after their leader and may still be forgotten
+        watcher = _Watcher(every=False)
+        for future in self._ft_map.values():
+            watcher.watch(future)
         self._ft_map.clear()
-        await asyncio.gather(*jobs)  # Make sure all tasks are done
+        self._watchers.append(watcher)
+        try:
+            while watcher.futures:
+                got = await watcher.get()
+                if got is not None:
+                    got[0].result()  # Raise the first failure, like gather
+        finally:
+            self._watchers.remove(watcher)
+            watcher.close()
 
     async def aclose(self):
         await self.join()  # Make sure all tasks are done
-        await self._buffer.put(None)  # Kill master
+        await self._enqueue(None)  # Kill master
         await self._event_hooks.aemit("puller.destroy", self)
         await self._client.aclose()
+        await self.writers.aclose()
+        if self._own_post_executor:
+            await async_run(self._post_executor.shutdown)  # type: ignore[union-attr]
+            self._post_executor, self._own_post_executor = None, False
+        if self._own_cache:
+            await self.cache.aclose()  # type: ignore[union-attr]
+        if self._own_journal:
+            await self.journal.aclose()  # type: ignore[union-attr]
+        elif self.journal is not None:
+            await self.journal.flush()
 
     async def __aenter__(self) -> AsyncPuller:
         return self
@@ -403,7 +1933,10 @@ class AsyncPuller(BasePuller):
     def __repr__(self):
         return f"{self.__class__.__name__}:\n" +\
             f"  max_retry: {self.max_retry}\n" +\
+            f"  max_workers: {self.max_workers}\n" +\
             f"  overwrite: {self.overwrite}\n" +\
+            f"  segments: {self.segments}\n" +\
+            f"  resume: {self.resume}\n" +\
             f"  headers: {self.headers}\n" +\
             f"  params: {self.params}\n" +\
             f"  cookies: {self.cookies}\n" +\
@@ -429,6 +1962,13 @@ class on_puller_hint(Hint):  # pragma: no cover
         """Callback Type: (event_name: str, AsyncPuller) -> None"""
         return self._chain.join
 
+    @property
+    def concurrency(self):
+        """Callback Type: (event_name: str, AsyncPuller,
+        max_workers: int, reason: str) -> None:
+        the controller changed the limit, reason is `"increase"` or `"decrease"`"""
+        return self._chain.concurrency
+
 
 class on_worker_hint(Hint):  # pragma: no cover
     @property
@@ -444,8 +1984,18 @@ class on_worker_hint(Hint):  # pragma: no cover
     def response_get(self):
         """Callback Type: (event_name: str, AsyncWorker, Response) -> None"""
     @property
+    def cache_hit(self):
+        """Callback Type: (event_name: str, AsyncWorker, Response | None) -> None:
+        response is `None` if the cached file is fresh"""
+    @property
     def bytes_get(self):
-        """Callback Type: (event_name: str, AsyncWorker, Response, bytes) -> None"""
+        """Callback Type: (event_name: str, AsyncWorker, Response, bytes) -> None:
+        emitted for every chunk, prefer `progress` for progress reporting"""
+    @property
+    def progress(self):
+        """Callback Type: (event_name: str, AsyncWorker,
+        downloaded: int, total: int | None) -> None:
+        cumulative bytes received in the current attempt, coalesced"""
     @property
     def retry(self):
         """Callback Type: (event_name: str, AsyncWorker, Exception, retry: int) -> None"""
@@ -0,0 +1,192 @@
+"""Retry Policies and Circuit Breakers for Pullers"""
+from __future__ import annotations
+import time
+import random
+from typing import Iterable
+from email.utils import parsedate_to_datetime
+import httpx
+from .checksums import ChecksumMismatch
+
+__all__ = ("RetryPolicy", "CircuitBreaker", "CircuitOpen")
+
+
+class CircuitOpen(Exception):
+    """Raised for pending jobs of a host whose circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """
+    # CircuitBreaker Class
+    Opens for a host (or key) after `threshold` consecutive failed attempts.
+
+    While open, pending jobs of the host are deferred, or failed with
+    `CircuitOpen` if `fail_fast`, instead of taking worker slots.
+    After `cooldown` seconds one trial job is let through,
+    its success closes the breaker and its failure opens it again.
+    """
+
+    def __init__(self, threshold: int = 5, cooldown: float = 30.0,
+                 fail_fast: bool = False):
+        """
+        * `threshold` - consecutive failed attempts opening the breaker
+        * `cooldown` - seconds the breaker stays open
+        * `fail_fast` - fail pending jobs while open instead of deferring them
+        """
+        self.threshold = max(threshold, 1)
+        self.cooldown = cooldown
+        self.fail_fast = fail_fast
+        self._failures: dict[str, int] = {}
+        self._opened: dict[str, float] = {}
+        """Time each open breaker was opened at"""
+        self._trials: set[str] = set()
+        """Keys with a trial job running"""
+
+    def state(self, key: str) -> str:
+        """`"closed"`, `"open"` or `"half-open"`."""
+        if key not in self._opened:
+            return "closed"
+        if time.monotonic() < self._opened[key] + self.cooldown:
+            return "open"
+        return "half-open"
+
+    def delay(self, key: str) -> float:
+        """Seconds until a job of `key` may start, `0` if it may now."""
+        if key not in self._opened:
+            return 0
+        remaining = self._opened[key] + self.cooldown - time.monotonic()
+        if remaining > 0:
+            return remaining
+        # Half open, wait for the trial to finish, which wakes the master
+        return max(self.cooldown, 1.0) if key in self._trials else 0
+
+    def acquire(self, key: str) -> None:
+        """Mark a job of `key` as started."""
+        if key in self._opened:
+            self._trials.add(key)
+
+    def release(self, key: str) -> None:
+        """Mark a job of `key` as finished."""
+        self._trials.discard(key)
+
+    def success(self, key: str) -> None:
+        """Record a successful attempt, closing the breaker."""
+        self._failures.pop(key, None)
+        self._opened.pop(key, None)
+        self._trials.discard(key)
+
+    def failure(self, key: str) -> bool:
+        """Record a failed attempt, returns whether the breaker opened."""
+        self._trials.discard(key)
+        if key in self._opened:  # Trial failed
+            self._opened[key] = time.monotonic()
+            return True
+        self._failures[key] = self._failures.get(key, 0) + 1
+        if self._failures[key] < self.threshold:
+            return False
+        del self._failures[key]
+        self._opened[key] = time.monotonic()
+        return True
+
+    def __repr__(self) -> str:
+        return f"CircuitBreaker(threshold={self.threshold}, " +\
+            f"cooldown={self.cooldown})"
+
+
+class RetryPolicy:
+    """
+    # RetryPolicy Class
+    Decides which failed attempts are retried and how long to wait.
+
+    Waits grow exponentially, or as decorrelated jitter if `jitter`,
+    so workers failing together don't retry in lockstep.
+    """
+
+    retry_status = frozenset((408, 425, 429, 500, 502, 503, 504))
+    """Default status codes worth retrying"""
+
+    def __init__(
+        self,
+        *,
+        base: float = 1.0,
+        factor: float = 1.7,
+        cap: float = 30.0,
+        jitter: bool = True,
+        retry_after: bool = True,
+        max_retry_after: float = 300.0,
+        statuses: Iterable[int] | None = retry_status,
+        fatal: tuple[type[BaseException], ...] = (
+            httpx.UnsupportedProtocol, httpx.TooManyRedirects),
+        breaker: CircuitBreaker | None = None,
+    ):
+        """
+        * `base` - first wait in seconds
+        * `factor` - growth of waits without jitter
+        * `cap` - max wait in seconds
+        * `jitter` - wait a random time between `base` and thrice
+        the last wait instead
+        * `retry_after` - wait at least as long as `Retry-After` asks
+        * `max_retry_after` - max seconds of `Retry-After` honored
+        * `statuses` - error status codes raised and retried, other error
+        responses fail at once. `None` saves error responses as is,
+        unless raised by a hook, and retries them all
+        * `fatal` - exceptions never retried
+        * `breaker` - `CircuitBreaker` shared by the hosts
+        """
+        self.base = base
+        self.factor = factor
+        self.cap = cap
+        self.jitter = jitter
+        self.retry_after = retry_after
+        self.max_retry_after = max_retry_after
+        self.statuses = None if statuses is None else frozenset(statuses)
+        self.fatal = fatal
+        self.breaker = breaker
+
+    def raises(self, status: int) -> bool:
+        """Whether a response with `status` is raised as an error."""
+        return self.statuses is not None and status >= 400
+
+    def retryable(self, e: BaseException) -> bool:
+        """Whether the attempt failed with `e` is worth retrying."""
+        if isinstance(e, self.fatal):
+            return False
+        if isinstance(e, httpx.HTTPStatusError):
+            return self.statuses is None \
+                or e.response.status_code in self.statuses
+        return isinstance(e, (httpx.HTTPError, httpx.StreamError,
+                              ChecksumMismatch))
+
+    def delay(self, e: BaseException, retry: int, last: float = 0) -> float:
+        """
+        Seconds to wait before the `retry`th retry.
+        * `last` - the last wait
+        """
+        if self.jitter:
+            wait = random.uniform(self.base, max(last, self.base) * 3)
+        else:
+            wait = self.base * self.factor ** retry
+        wait = min(wait, self.cap)
+        if self.retry_after and isinstance(e, httpx.HTTPStatusError):
+            after = _retry_after(e.response)
+            if after is not None:
+                wait = max(wait, min(after, self.max_retry_after))
+        return wait
+
+    def __repr__(self) -> str:
+        return f"RetryPolicy(base={self.base}, cap={self.cap}, " +\
+            f"jitter={self.jitter}, breaker={self.breaker})"
+
+
+def _retry_after(r: httpx.Response) -> float | None:
+    """Seconds asked by the `Retry-After` header of `r`, if any."""
+    value = r.headers.get("Retry-After")
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0)
+    except (ValueError, TypeError):
+        return None
@@ -0,0 +1,286 @@
+"""Multi-Process Sharded Puller"""
+from __future__ import annotations
+import os
+import zlib
+import queue
+import pickle
+import asyncio
+import threading
+import multiprocessing
+import multiprocessing.connection
+from functools import partial
+from itertools import count
+from typing import Any
+import httpx
+from ...asynctools import async_run
+from ...react import EventHook
+from .pullers import BasePuller, AsyncPuller, AsyncWorker
+
+__all__ = ("ShardedPuller", "ShardEvent", "ShardError")
+
+EVENTS = ("worker.start", "worker.progress", "worker.retry",
+          "worker.success", "worker.fail", "worker.destroy")
+"""Worker events streamed back from the shards"""
+
+
+class ShardError(Exception):
+    """Stands for an exception of a shard that can't be pickled."""
+
+
+class ShardEvent:
+    """A worker event of a shard, as plain data."""
+
+    __slots__ = ("shard", "url", "path", "args")
+
+    def __init__(self, shard: int, url: str, path: str | None, args: tuple):
+        self.shard = shard
+        self.url = url
+        self.path = path
+        self.args = args
+        """Arguments of the event, responses become their status codes"""
+
+    def __repr__(self) -> str:
+        return f"ShardEvent({self.shard}, {self.url}, {self.args})"
+
+
+def _portable(value: Any) -> Any:
+    """Make `value` safe to send to the parent process."""
+    if isinstance(value, httpx.Response):
+        return value.status_code
+    if isinstance(value, BaseException):
+        try:
+            pickle.loads(pickle.dumps(value))
+        except Exception:
+            return ShardError(f"{type(value).__name__}: {value}")
+    return value
+
+
+def _serve(shard: int, options: dict[str, Any],
+           jobs: multiprocessing.Queue, results: multiprocessing.Queue) -> None:
+    """Entry of shard processes."""
+    asyncio.run(_aserve(shard, options, jobs, results))
+
+
+async def _aserve(shard: int, options: dict[str, Any],
+                  jobs: multiprocessing.Queue,
+                  results: multiprocessing.Queue) -> None:
+    def report(job_id: int, future: asyncio.Future) -> None:
+        if future.cancelled():
+            results.put(("done", job_id, None, ShardError("Cancelled")))
+        elif future.exception() is not None:
+            results.put(("done", job_id, None, _portable(future.exception())))
+        else:
+            results.put(("done", job_id, future.result(), None))
+
+    async with AsyncPuller(**options) as puller:
+        for event in EVENTS:
+            async def forward(event: str, worker: AsyncWorker, *args):
+                results.put(("event", event, ShardEvent(
+                    shard, worker.url, worker.path,
+                    tuple(_portable(a) for a in args))))
+
+            puller.event_hooks[event].append(forward)
+
+        while (job := await async_run(jobs.get)) is not None:
+            job_id, payload = job
+            try:
+                url, path, kw = pickle.loads(payload)
+                future = await puller.pull(url, path, **kw)
+            except Exception as e:
+                results.put(("done", job_id, None, _portable(e)))
+                continue
+            puller._ft_map.pop(id(future), None)  # Reported, not joined
+            future.add_done_callback(partial(report, job_id))
+        await puller.join()
+    results.put(("closed", shard, None, None))
+
+
+class ShardedPuller(BasePuller):
+    """
+    # ShardedPuller Class
+    Spreads jobs across processes, each running its own `AsyncPuller`,
+    so TLS, HTTP/2 framing and decompression use more than one core.
+
+    Jobs are sharded by host (or `limit_key`), so connections are still
+    reused and per-host limits still hold within a shard.
+    Results and worker events stream back to this process,
+    events arrive as `ShardEvent`s, e.g.
+    `@puller.on.worker.progress` gets `(event, shard_event)`.
+
+    Options of pullers must be picklable, event hooks and
+    modifiers can't be passed to the shards.
+    Jobs of a shard that dies fail with `ShardError`.
+    """
+
+    poll_interval = 0.1
+    """Seconds between two looks for dead shards while no message arrives"""
+
+    def __init__(self, processes: int | None = None, **options: Any):
+        """
+        * `processes` - number of shards, set to None will use CPU count
+        * `**options` - keyword arguments of each `AsyncPuller`
+        """
+        if "event_hooks" in options or "loop" in options:
+            raise ValueError("event_hooks and loop can't be sent to shards")
+        self.processes = max(processes or os.cpu_count() or 1, 1)
+        self.options = options
+        self._event_hooks = EventHook({event: [] for event in EVENTS})
+        self._ids = count()
+        self._futures: dict[int, asyncio.Future] = {}
+        """Futures of unfinished jobs by id"""
+        self._shards: dict[int, int] = {}
+        """Shards of unfinished jobs by id"""
+        self._lost: dict[int, ShardError] = {}
+        """Why each dead shard died by index"""
+        self._ft_map: dict[int, asyncio.Future] = {}
+        """Futures not joined yet by id"""
+        self._jobs: list[multiprocessing.Queue] = []
+        self._results: multiprocessing.Queue | None = None
+        self._procs: list[multiprocessing.process.BaseProcess] = []
+        self._reader: threading.Thread | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+
+    @property
+    def event_hooks(self) -> EventHook:
+        return self._event_hooks
+
+    @property
+    def on(self):
+        return self._event_hooks.on
+
+    def shard_of(self, url: str, limit_key: str | None = None) -> int:
+        """Index of the shard pulling `url`."""
+        key = limit_key or httpx.URL(url).host
+        return zlib.crc32(key.encode()) % self.processes
+
+    def _start(self) -> None:
+        ctx = multiprocessing.get_context("spawn")
+        self._loop = asyncio.get_running_loop()
+        self._results = ctx.Queue()
+        for shard in range(self.processes):
+            jobs = ctx.Queue()
+            proc = ctx.Process(
+                target=_serve, args=(shard, self.options, jobs, self._results),
+                name=f"puller-shard-{shard}", daemon=True)
+            proc.start()
+            self._jobs.append(jobs)
+            self._procs.append(proc)
+        self._reader = threading.Thread(
+            target=self._read, name="puller-shard-reader", daemon=True)
+        self._reader.start()
+
+    def _read(self) -> None:
+        """Hand messages of the shards to the event loop, in a thread."""
+        assert self._results is not None and self._loop is not None
+        closed: set[int] = set()
+        dead: set[int] = set()
+        while len(closed) < self.processes:
+            try:
+                msg = self._results.get(timeout=self.poll_interval)
+            except queue.Empty:
+                msg = None
+            alive = {self._procs[i].sentinel: i for i in range(self.processes)
+                     if i not in closed and i not in dead}
+            for sentinel in multiprocessing.connection.wait(list(alive), 0):
+                shard = alive[sentinel]  # type: ignore[index]
+                dead.add(shard)
+                # Queued after the last messages of the shard
+                self._results.put(("lost", shard, self._procs[shard].exitcode, None))
+            if msg is None:
+                continue
+            if msg[0] == "closed":
+                closed.add(msg[1])
+            elif msg[0] == "lost":
+                if msg[1] not in closed:
+                    closed.add(msg[1])
+                    self._loop.call_soon_threadsafe(self._lose, msg[1], msg[2])
+            else:
+                self._loop.call_soon_threadsafe(self._receive, msg)
+
+    def _lose(self, shard: int, exitcode: int | None) -> None:
+        """Fail the unfinished jobs of the dead `shard`."""
+        error = self._lost[shard] = ShardError(
+            f"Shard {shard} died with exit code {exitcode}")
+        for job_id in [i for i, s in self._shards.items() if s == shard]:
+            del self._shards[job_id]
+            future = self._futures.pop(job_id)
+            if not future.done():
+                future.set_exception(error)
+
+    def _receive(self, msg: tuple) -> None:
+        kind, *rest = msg
+        if kind == "event":
+            event, shard_event = rest
+            self._loop.create_task(  # type: ignore[union-attr]
+                self._event_hooks.aemit(event, shard_event))
+            return
+        job_id, result, error = rest
+        self._shards.pop(job_id, None)
+        future = self._futures.pop(job_id)
+        if future.done():
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    async def pull(self, url: str, path: str | os.PathLike | None,
+                   **kw: Any) -> asyncio.Future:
+        """
+        ### Pull a file from a url in the shard of its host.
+        Returns a `Future` of the path of the downloaded file.
+        * `url`: url to pull from
+        * `path`: path to save to, set to `None` or `""` will not save file
+        * `**kw`: keyword arguments of `AsyncPuller.pull`, must be picklable
+        """
+        path = os.fspath(path) if path else None
+        try:
+            payload = pickle.dumps((url, path, kw))
+        except Exception as e:
+            raise ValueError(f"Arguments can't be sent to shards: {e}") from e
+        if not self._procs:
+            self._start()
+        job_id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        self._ft_map[job_id] = future
+        shard = self.shard_of(url, kw.get("limit_key"))
+        if shard in self._lost:
+            future.set_exception(self._lost[shard])
+            return future
+        self._futures[job_id] = future
+        self._shards[job_id] = shard
+        self._jobs[shard].put((job_id, payload))
+        return future
+
+    async def join(self) -> None:
+        """### Wait for all jobs to finish."""
+        jobs = list(self._ft_map.values())
+        self._ft_map.clear()
+        await asyncio.gather(*jobs)
+
+    async def aclose(self) -> None:
+        """Finish the jobs and stop the shards."""
+        try:
+            await self.join()
+        finally:
+            if self._procs:
+                for jobs in self._jobs:
+                    jobs.put(None)
+                for proc in self._procs:
+                    await async_run(proc.join)
+                if self._reader is not None:
+                    await async_run(self._reader.join)
+                await asyncio.sleep(0)  # Let the last events be emitted
+                self._procs.clear()
+                self._jobs.clear()
+                self._lost.clear()
+
+    async def __aenter__(self) -> ShardedPuller:
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb) -> bool:
+        await self.aclose()
+        return False
+
+    def __repr__(self) -> str:
+        return f"ShardedPuller(processes={self.processes})"
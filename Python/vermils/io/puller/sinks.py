@@ -0,0 +1,217 @@
+"""In-Memory, Callback and Archive Sinks for Pullers"""
+from __future__ import annotations
+import os
+import queue
+import asyncio
+import tarfile
+from typing import IO, Any, Awaitable, Callable, cast
+from ...asynctools import async_run
+
+__all__ = ("MemorySink", "CallbackSink", "TarSink", "UnsafeMemberError", "Consumer")
+
+Consumer = Callable[[bytes], Awaitable[Any]]
+
+
+class MemorySink:
+    """
+    # MemorySink Class
+    Collects a body into a `bytearray`, preallocated when its size is known,
+    so chunks are copied in place instead of growing the buffer.
+    """
+
+    __slots__ = ("_buffer", "_pos")
+
+    def __init__(self, size: int | None = None):
+        """
+        * `size` - expected size of the body, e.g. its `Content-Length`
+        """
+        self._buffer = bytearray(size or 0)
+        self._pos = 0
+
+    async def write(self, data: bytes) -> int:
+        end = self._pos + len(data)
+        if end <= len(self._buffer):
+            self._buffer[self._pos:end] = data
+        else:  # More than expected
+            del self._buffer[self._pos:]
+            self._buffer += data
+        self._pos = end
+        return len(data)
+
+    async def flush(self) -> None:
+        pass
+
+    def getvalue(self) -> bytearray:
+        """The collected body, trimmed to what was written."""
+        del self._buffer[self._pos:]
+        return self._buffer
+
+    def __len__(self) -> int:
+        return self._pos
+
+    def __repr__(self) -> str:
+        return f"MemorySink({self._pos}/{len(self._buffer)})"
+
+
+class CallbackSink:
+    """Hands each chunk of a body to an async consumer, in order."""
+
+    __slots__ = ("consumer",)
+
+    def __init__(self, consumer: Consumer):
+        self.consumer = consumer
+
+    async def write(self, data: bytes) -> int:
+        await self.consumer(data)
+        return len(data)
+
+    async def flush(self) -> None:
+        pass
+
+    def __repr__(self) -> str:
+        return f"CallbackSink({self.consumer})"
+
+
+class UnsafeMemberError(tarfile.TarError):
+    """Raised for archive members that would escape the target directory."""
+
+
+class _Abort(Exception):
+    """Stops an extraction whose body failed."""
+
+
+class _Pipe:
+    """Readable end of the chunks written to a `TarSink`, read in a thread."""
+
+    def __init__(self, sink: TarSink):
+        self._sink = sink
+        self._rest = bytearray()
+        self._eof = False
+
+    def read(self, size: int = -1) -> bytes:
+        while not self._eof and (size < 0 or len(self._rest) < size):
+            chunk = self._sink._chunks.get()
+            if chunk is None:
+                self._eof = True
+            elif isinstance(chunk, _Abort):
+                raise chunk
+            else:
+                self._rest += chunk
+                self._sink._loop.call_soon_threadsafe(
+                    self._sink._consumed, len(chunk))
+        if size < 0 or size >= len(self._rest):
+            data, self._rest = bytes(self._rest), bytearray()
+        else:
+            data = bytes(self._rest[:size])
+            del self._rest[:size]
+        return data
+
+
+class TarSink:
+    """
+    # TarSink Class
+    Extracts a tar archive, plain or compressed with gzip, bzip2 or xz,
+    into `directory` as its body streams in, so the archive itself
+    never touches the disk.
+
+    Extraction runs in a thread, up to `max_buffered` bytes ahead of it
+    are buffered. Members escaping `directory`, links pointing out of it
+    and device files raise `UnsafeMemberError`.
+
+    Each `async with` is one extraction, so a sink can be reused by retries.
+    """
+
+    def __init__(self, directory: str | os.PathLike, max_buffered: int = 2**23):
+        """
+        * `directory` - where members are extracted to, created if missing
+        * `max_buffered` - max bytes buffered ahead of the extraction
+        """
+        self.directory = os.path.realpath(directory)
+        self.max_buffered = max(max_buffered, 1)
+        self._chunks: queue.SimpleQueue[bytes | _Abort | None] = queue.SimpleQueue()
+        self._buffered = 0
+        self._drained = asyncio.Event()
+        self._task: asyncio.Future | None = None
+        self._loop: asyncio.AbstractEventLoop = None  # type: ignore[assignment]
+
+    def _check(self, member: tarfile.TarInfo) -> None:
+        """Raise `UnsafeMemberError` unless `member` stays in `directory`."""
+        root = self.directory
+
+        def inside(path: str) -> bool:
+            return os.path.commonpath([root, os.path.realpath(path)]) == root
+
+        target = os.path.join(root, member.name)
+        if os.path.isabs(member.name) or not inside(target):
+            raise UnsafeMemberError(f"{member.name} is outside the directory")
+        if member.issym() or member.islnk():
+            base = os.path.dirname(target) if member.issym() else root
+            if os.path.isabs(member.linkname) \
+                    or not inside(os.path.join(base, member.linkname)):
+                raise UnsafeMemberError(
+                    f"{member.name} links outside the directory")
+        elif not (member.isfile() or member.isdir()):
+            raise UnsafeMemberError(f"{member.name} is a special file")
+
+    def _extract(self) -> None:
+        """Extract the archive from the chunks, blocks."""
+        os.makedirs(self.directory, exist_ok=True)
+        pipe = cast(IO[bytes], _Pipe(self))
+        kw: dict[str, Any] = {"set_attrs": False}
+        if hasattr(tarfile, "data_filter"):
+            kw["filter"] = "data"
+        with tarfile.open(fileobj=pipe, mode="r|*") as tar:
+            for member in tar:
+                self._check(member)
+                tar.extract(member, self.directory, **kw)
+        while pipe.read(2**20):
+            pass  # Padding after the archive
+
+    def _consumed(self, size: int) -> None:
+        self._buffered -= size
+        if self._buffered <= self.max_buffered:
+            self._drained.set()
+
+    async def __aenter__(self) -> TarSink:
+        if self._task is not None:
+            raise RuntimeError("Extraction already running")
+        self._loop = asyncio.get_running_loop()
+        self._chunks = queue.SimpleQueue()
+        self._buffered = 0
+        self._drained = asyncio.Event()
+        self._task = asyncio.ensure_future(async_run(self._extract))
+        return self
+
+    async def __aexit__(self, exc_t, exc_v, exc_tb) -> bool:
+        task, self._task = self._task, None
+        assert task is not None
+        self._chunks.put(None if exc_t is None else _Abort())
+        try:
+            await task
+        except _Abort:
+            pass
+        except Exception:
+            if exc_t is None:
+                raise
+        return False
+
+    async def write(self, data: bytes) -> int:
+        assert self._task is not None
+        if self._task.done():
+            await self._task  # Raise why the extraction stopped
+            raise RuntimeError("Extraction stopped early")
+        self._chunks.put(data)
+        self._buffered += len(data)
+        while self._buffered > self.max_buffered and not self._task.done():
+            self._drained.clear()
+            drained = asyncio.ensure_future(self._drained.wait())
+            await asyncio.wait([self._task, drained],
+                               return_when=asyncio.FIRST_COMPLETED)
+            drained.cancel()
+        return len(data)
+
+    async def flush(self) -> None:
+        pass
+
+    def __repr__(self) -> str:
+        return f"TarSink({self.directory})"
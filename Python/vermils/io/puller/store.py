@@ -0,0 +1,116 @@
+"""Content-Addressed Storage for Pullers"""
+from __future__ import annotations
+import os
+import shutil
+import hashlib
+from uuid import uuid4
+from contextlib import suppress
+
+__all__ = ("BlobStore", "link_file")
+
+FICLONE = 0x40049409
+"""`ioctl` request cloning a file on Linux (btrfs, XFS)"""
+
+
+def _reflink(src: str, dst: str) -> None:
+    """Clone `src` to `dst` sharing their extents, copy on write."""
+    import fcntl  # Unix only
+    try:
+        with open(src, "rb") as s, open(dst, "wb") as d:
+            fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+    except OSError:
+        with suppress(FileNotFoundError):
+            os.remove(dst)
+        raise
+
+
+def link_file(src: str | os.PathLike, dst: str | os.PathLike) -> None:
+    """
+    Make `dst` a reflink, else a hard link, else a copy of `src`,
+    replacing it atomically. Blocks.
+    """
+    tmp = f"{os.fspath(dst)}.{uuid4().hex[:8]}.tmp"
+    try:
+        try:
+            _reflink(os.fspath(src), tmp)
+        except (OSError, ImportError):
+            try:
+                os.link(src, tmp)
+            except OSError:  # e.g. across devices
+                shutil.copyfile(src, tmp)
+        os.replace(tmp, dst)
+    except BaseException:
+        with suppress(FileNotFoundError):
+            os.remove(tmp)
+        raise
+
+
+class BlobStore:
+    """
+    # BlobStore Class
+    Files stored once under the digest of their content,
+    requested paths are linked to them.
+
+    Links are reflinks where the filesystem supports them,
+    otherwise hard links, otherwise copies.
+    Beware that a hard-linked path shares its content with the store,
+    so it should be replaced rather than modified in place.
+
+    Methods block, run them in a thread.
+    """
+
+    def __init__(self, root: str | os.PathLike, algorithm: str = "sha256"):
+        """
+        * `root` - directory of the store, created if missing
+        * `algorithm` - name of the `hashlib` algorithm of digests
+        """
+        hashlib.new(algorithm)  # Fail early on unknown algorithms
+        self.root = os.fspath(root)
+        self.algorithm = algorithm
+        os.makedirs(os.path.join(self.root, "tmp"), exist_ok=True)
+
+    def hasher(self) -> hashlib._Hash:
+        """A new hash object of the algorithm of the store."""
+        return hashlib.new(self.algorithm)
+
+    def blob(self, digest: str) -> str:
+        """Path of the blob of `digest`."""
+        digest = digest.lower()
+        return os.path.join(self.root, digest[:2], digest)
+
+    def has(self, digest: str) -> bool:
+        """Whether the blob of `digest` is stored."""
+        return os.path.isfile(self.blob(digest))
+
+    def temp(self) -> str:
+        """A unique path to write a blob to before its digest is known."""
+        return os.path.join(self.root, "tmp", uuid4().hex)
+
+    def digest(self, file: str | os.PathLike) -> str:
+        """Hash `file` from the start."""
+        h = self.hasher()
+        with open(file, "rb") as f:
+            while chunk := f.read(2**20):
+                h.update(chunk)
+        return h.hexdigest()
+
+    def ingest(self, file: str | os.PathLike, digest: str) -> str:
+        """
+        Move `file` into the store under `digest`,
+        it's dropped if the blob is already stored.
+        Returns the path of the blob.
+        """
+        blob = self.blob(digest)
+        if os.path.isfile(blob):
+            os.remove(file)
+        else:
+            os.makedirs(os.path.dirname(blob), exist_ok=True)
+            os.replace(file, blob)
+        return blob
+
+    def link(self, digest: str, path: str | os.PathLike) -> None:
+        """Link `path` to the blob of `digest`, replacing it atomically."""
+        link_file(self.blob(digest), path)
+
+    def __repr__(self) -> str:
+        return f"BlobStore({self.root}, {self.algorithm})"
@@ -0,0 +1,382 @@
+"""Shared Write-Behind File Writers for Pullers"""
+from __future__ import annotations
+import os
+import errno
+from abc import ABC, abstractmethod
+from asyncio import Future
+from typing import IO, Callable, TypeVar, ParamSpec
+from ...asynctools import AsinkRunner
+
+__all__ = ("WriterPool", "PooledFile", "PositionalFile", "FileCursor")
+T = TypeVar("T")
+ARGS = ParamSpec("ARGS")
+
+
+def _pwrite(fd: int, data: bytes, offset: int) -> None:
+    """Write all of `data` at `offset` of `fd`."""
+    view = memoryview(data)
+    while view:
+        if hasattr(os, "pwrite"):
+            n = os.pwrite(fd, view, offset)
+        else:  # Only one thread writes each file, seeking is safe
+            os.lseek(fd, offset, os.SEEK_SET)
+            n = os.write(fd, view)
+        view = view[n:]
+        offset += n
+
+
+def _allocate(fd: int, size: int) -> None:
+    """Reserve `size` bytes for `fd`."""
+    if hasattr(os, "posix_fallocate"):
+        try:
+            os.posix_fallocate(fd, 0, size)
+            return
+        except OSError as e:
+            if e.errno not in (errno.EOPNOTSUPP, errno.EINVAL):
+                raise  # e.g. ENOSPC
+    if os.fstat(fd).st_size < size:
+        os.ftruncate(fd, size)
+
+
+class _WriteBehind(ABC):
+    """
+    Write-behind buffering of the files of a `WriterPool`.
+
+    Writes are buffered and handed to the thread as large coalesced chunks
+    without waiting for them, with one chunk in flight at a time,
+    so the order of writes is kept.
+    """
+
+    def __init__(self, pool: WriterPool):
+        self._pool = pool
+        self._chunks: list[bytes] = []
+        self._buffered = 0
+        self._inflight: Future | None = None
+
+    @property
+    @abstractmethod
+    def closed(self) -> bool:
+        """Whether the file is closed."""
+
+    @abstractmethod
+    def _write_chunk(self, data: bytes) -> Future:
+        """Start writing `data` after the chunks before it, in the thread."""
+
+    async def _wait(self) -> None:
+        """Wait for the chunk in flight."""
+        if self._inflight is not None:
+            fut, self._inflight = self._inflight, None
+            await fut
+
+    def _submit(self) -> None:
+        """Hand the buffered chunks to the thread as one write."""
+        data = self._chunks[0] if len(self._chunks) == 1 \
+            else b"".join(self._chunks)
+        self._chunks = []
+        self._buffered = 0
+        self._inflight = self._write_chunk(data)
+
+    async def _drain(self) -> None:
+        """Wait until every buffered chunk is written."""
+        await self._wait()
+        if self._chunks:
+            self._submit()
+            await self._wait()
+
+    async def write(self, data: bytes) -> int:
+        if self.closed:
+            raise ValueError("I/O operation on closed file")
+        self._chunks.append(data)
+        self._buffered += len(data)
+        if self._inflight is not None and self._inflight.done():
+            await self._wait()  # Raise errors early
+        if self._buffered >= self._pool.buffer_size:
+            await self._wait()
+            self._submit()
+        return len(data)
+
+
+class PooledFile(_WriteBehind):
+    """
+    # PooledFile Class
+    An async binary file written through one thread of a `WriterPool`,
+    behind a write buffer.
+    """
+
+    def __init__(self, pool: WriterPool, file: str | os.PathLike, mode: str = "wb"):
+        super().__init__(pool)
+        self._name = file
+        self._mode = mode
+        self._runner: AsinkRunner | None = None
+        self._file: IO[bytes] | None = None
+
+    async def open(self) -> PooledFile:
+        """Open the file in its pool thread."""
+        self._runner = self._pool._acquire()
+        try:
+            self._file = await self._runner.run(open, self._name, self._mode)
+        except BaseException:
+            self._pool._release(self._runner)
+            raise
+        return self
+
+    async def __aenter__(self) -> PooledFile:
+        return await self.open()
+
+    async def __aexit__(self, exc_t, exc_v, exc_tb) -> bool:
+        await self.close()
+        return False
+
+    def _run(self, func: Callable[ARGS, T],
+             *args: ARGS.args, **kw: ARGS.kwargs) -> Future[T]:
+        if self._runner is None or self._file is None:
+            raise ValueError("I/O operation on closed file")
+        return self._runner.run(func, *args, **kw)
+
+    def _write_chunk(self, data: bytes) -> Future:
+        return self._run(self._file.write, data)  # type: ignore[union-attr]
+
+    async def flush(self) -> None:
+        await self._drain()
+        await self._run(self._file.flush)  # type: ignore[union-attr]
+
+    async def seek(self, offset: int, whence: int = 0) -> int:
+        await self._drain()
+        return await self._run(self._file.seek,  # type: ignore[union-attr]
+                               offset, whence)
+
+    async def tell(self) -> int:
+        await self._drain()
+        return await self._run(self._file.tell)  # type: ignore[union-attr]
+
+    async def truncate(self, size: int | None = None) -> int:
+        await self._drain()
+        return await self._run(self._file.truncate,  # type: ignore[union-attr]
+                               size)
+
+    async def close(self) -> None:
+        if self._file is None:
+            return
+        try:
+            await self._drain()
+        finally:
+            try:
+                await self._run(self._file.close)
+            finally:
+                self._pool._release(self._runner)  # type: ignore[arg-type]
+                self._file = None
+
+    @property
+    def closed(self) -> bool:
+        return self._file is None
+
+    @property
+    def name(self) -> str | os.PathLike:
+        return self._name
+
+    @property
+    def mode(self) -> str:
+        return self._mode
+
+    def __repr__(self) -> str:
+        return f"PooledFile({self._name}, {self._mode})"
+
+
+class FileCursor(_WriteBehind):
+    """
+    # FileCursor Class
+    A producer writing a `PositionalFile` from an offset onwards,
+    behind a write buffer of its own.
+    """
+
+    def __init__(self, file: PositionalFile, offset: int):
+        super().__init__(file._pool)
+        self._file = file
+        self._offset = offset
+        """Offset of the buffered chunks"""
+
+    @property
+    def closed(self) -> bool:
+        return self._file.closed
+
+    def _write_chunk(self, data: bytes) -> Future:
+        fut = self._file._run(_pwrite, self._file.fileno(), data, self._offset)
+        self._offset += len(data)
+        return fut
+
+    async def flush(self) -> None:
+        """Wait until every buffered chunk is written."""
+        await self._drain()
+
+    async def seek(self, offset: int, whence: int = 0) -> int:
+        await self.flush()
+        if whence != os.SEEK_SET:
+            raise ValueError("Cursors only seek from the start")
+        self._offset = offset
+        return offset
+
+    async def tell(self) -> int:
+        return self._offset + self._buffered
+
+    def __repr__(self) -> str:
+        return f"FileCursor({self._file}, {self._offset})"
+
+
+class PositionalFile:
+    """
+    # PositionalFile Class
+    An async binary file written at explicit offsets through one thread
+    of a `WriterPool`, with `os.pwrite` where available.
+
+    Several producers may write it at once through their own `cursor`,
+    without coordinating seeks.
+    """
+
+    def __init__(self, pool: WriterPool, file: str | os.PathLike,
+                 truncate: bool = True):
+        self._pool = pool
+        self._name = file
+        self._truncate = truncate
+        self._runner: AsinkRunner | None = None
+        self._fd: int | None = None
+        self._cursors: list[FileCursor] = []
+
+    async def open(self) -> PositionalFile:
+        """Open the file in its pool thread."""
+        flags = os.O_WRONLY | os.O_CREAT | getattr(os, "O_BINARY", 0)
+        if self._truncate:
+            flags |= os.O_TRUNC
+        self._runner = self._pool._acquire()
+        try:
+            self._fd = await self._runner.run(os.open, self._name, flags, 0o666)
+        except BaseException:
+            self._pool._release(self._runner)
+            raise
+        return self
+
+    async def __aenter__(self) -> PositionalFile:
+        return await self.open()
+
+    async def __aexit__(self, exc_t, exc_v, exc_tb) -> bool:
+        await self.close()
+        return False
+
+    def _run(self, func: Callable[ARGS, T],
+             *args: ARGS.args, **kw: ARGS.kwargs) -> Future[T]:
+        if self._runner is None or self._fd is None:
+            raise ValueError("I/O operation on closed file")
+        return self._runner.run(func, *args, **kw)
+
+    def fileno(self) -> int:
+        if self._fd is None:
+            raise ValueError("I/O operation on closed file")
+        return self._fd
+
+    def cursor(self, offset: int = 0) -> FileCursor:
+        """A new producer writing from `offset` onwards."""
+        cursor = FileCursor(self, offset)
+        self._cursors.append(cursor)
+        return cursor
+
+    async def allocate(self, size: int) -> None:
+        """
+        Reserve `size` bytes on disk up front with `posix_fallocate`,
+        or extend the file where it's not supported.
+        Raises `OSError` early if the disk is full.
+        """
+        await self._run(_allocate, self.fileno(), size)
+
+    async def truncate(self, size: int) -> None:
+        await self._run(os.ftruncate, self.fileno(), size)
+
+    async def close(self) -> None:
+        """Flush all cursors and close the file."""
+        if self._fd is None:
+            return
+        try:
+            for cursor in self._cursors:
+                await cursor.flush()
+        finally:
+            try:
+                await self._run(os.close, self._fd)
+            finally:
+                self._pool._release(self._runner)  # type: ignore[arg-type]
+                self._fd = None
+                self._cursors = []
+
+    @property
+    def closed(self) -> bool:
+        return self._fd is None
+
+    @property
+    def name(self) -> str | os.PathLike:
+        return self._name
+
+    def __repr__(self) -> str:
+        return f"PositionalFile({self._name})"
+
+
+class WriterPool:
+    """
+    # WriterPool Class
+    A bounded pool of `AsinkRunner` threads shared by all the files
+    a puller writes, instead of a thread per file.
+
+    Each open file sticks to the least busy thread.
+    Threads are started on first use.
+    """
+
+    def __init__(self, threads: int = 4, buffer_size: int = 2**20):
+        """
+        * `threads` - max writer threads
+        * `buffer_size` - bytes buffered by each file before they are written
+        """
+        self.buffer_size = buffer_size
+        self._runners = [AsinkRunner() for _ in range(max(threads, 1))]
+        self._files = [0] * len(self._runners)
+        """Open files of each runner"""
+
+    def _acquire(self) -> AsinkRunner:
+        i = self._files.index(min(self._files))
+        self._files[i] += 1
+        return self._runners[i]
+
+    def _release(self, runner: AsinkRunner) -> None:
+        self._files[self._runners.index(runner)] -= 1
+
+    def open(self, file: str | os.PathLike, mode: str = "wb") -> PooledFile:
+        """
+        Open a binary file for writing, use with `async with`
+        or await `PooledFile.open`.
+        """
+        if "b" not in mode or "r" in mode and "+" not in mode:
+            raise ValueError(f"Not a binary writing mode: {mode}")
+        return PooledFile(self, file, mode)
+
+    def open_positional(self, file: str | os.PathLike,
+                        truncate: bool = True) -> PositionalFile:
+        """
+        Open a binary file for positional writing, use with `async with`
+        or await `PositionalFile.open`.
+        """
+        return PositionalFile(self, file, truncate)
+
+    async def run(self, func: Callable[ARGS, T],
+                  *args: ARGS.args, **kw: ARGS.kwargs) -> T:
+        """Run a function in the least busy thread."""
+        runner = self._acquire()
+        try:
+            return await runner.run(func, *args, **kw)
+        finally:
+            self._release(runner)
+
+    @property
+    def threads(self) -> int:
+        """Number of threads started and not closed."""
+        return sum(r.alive and not r.closed for r in self._runners)
+
+    async def aclose(self) -> None:
+        """Stop all threads."""
+        for runner in self._runners:
+            if runner.alive and not runner.closed:
+                await runner.aclose()